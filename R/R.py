@@ -1,12 +1,14 @@
+from codecs import getincrementaldecoder
 from collections import deque
 from copy import copy
 from enum import Enum
 from itertools import chain
 from typing import Callable
 
-from .Result import Result, Success, Fail
-from .cache import cache_deco, cache_clear
-from .util import parse_n, make_gen, str_n, explain_n
+from .Result import Result, Success, Fail, Span
+from .analysis import seeker, bounds
+from .cache import cache_deco, Context
+from .util import parse_n, make_gen, str_n, explain_n, BranchStop, MatchLimit, _NeedMore
 
 
 class RecursionWrapper:
@@ -44,6 +46,18 @@ class R:
 
         # 状态机
         self.gen = make_gen(self.target) if not isinstance(self.target, (R, RecursionWrapper)) else None
+        # 编译后的 NFA, 见 compile
+        self.program = None
+        # (min_len, max_len) 的缓存, 见 bounds
+        self._bounds = None
+        # 改写后的等价 R, 见 optimize
+        self.optimized = None
+        # | 链按下一个字符选择分支的分派表, 见 optimize.dispatch_of
+        self.dispatch = None
+        # 生成的专用匹配函数, 见 codegen
+        self.generated = None
+        # 改写和编译结果的磁盘缓存, 见 diskcache.PatternCache.attach
+        self.store = None
 
     @property
     def target(self):
@@ -106,8 +120,44 @@ class R:
             s += str(self.next_r)
         return s
 
+    def __copy__(self):
+        # 浅复制, 不经过 __reduce__
+        this = R.__new__(R)
+        this.__dict__.update(self.__dict__)
+        return this
+
+    def __deepcopy__(self, memo: dict):
+        # 深复制不经过 __reduce__, lambda 目标照常复制; 函数目标和编译结果共用
+        from .nfa import copy_tree
+        this = memo[id(self)] = copy_tree(self, {}, keep_program=True)
+        this.optimized = None
+        this.generated = None
+        return this
+
+    def __reduce__(self):
+        # pickle 时转为可序列化的数据, 见 to_portable
+        from .portable import from_portable
+        return from_portable, (self.to_portable(),)
+
+    def to_portable(self):
+        '''
+        返回可 pickle 的数据, 共享的节点和 RecursionWrapper 的环按下标引用
+        '''
+        from .portable import to_portable
+        return to_portable(self)
+
+    @staticmethod
+    def from_portable(data: dict):
+        from .portable import from_portable
+        return from_portable(data)
+
     def clone(self, num=None, name: str = None, mode: Mode = None):
         this = copy(self)
+        this.program = None
+        this._bounds = None
+        this.optimized = None
+        this.dispatch = None
+        this.generated = None
         if num is not None:
             this.num_t = parse_n(num)
         if name:
@@ -116,15 +166,93 @@ class R:
             this.mode = mode
         return this
 
+    @property
+    def bounds(self):
+        '''
+        (min_len, max_len): 成功的结果的最短长度, 一次匹配最多读取的字符数(无界时为 inf)
+        '''
+        return bounds(self)
+
+    def optimize(self):
+        '''
+        返回等价且节点更少的 R: 合并相邻的字符串, 去掉多余的包装节点, 提取分支的公共前缀, 见 optimize.py
+        结果缓存在 self.optimized 中, match 等方法首次调用时自动执行
+        '''
+        if self.optimized is None:
+            if self.store is not None:
+                self.optimized = self.store.optimize(self)
+            else:
+                from .optimize import optimize_tree
+                self.optimized = optimize_tree(self)
+        return self.optimized
+
+    def intern(self):
+        '''
+        返回等价的 R, 其中结构相同的节点(包括其他调用 intern 或已改写的 R 中的节点)是同一个实例
+        相同的子模式在相同的位置共用缓存条目, 大量模式共用的片段只保留一份, 见 optimize.intern_trees
+        改写(optimize)的结果总是经过 intern
+        '''
+        from .nfa import copy_tree
+        from .optimize import intern_trees
+        return intern_trees([copy_tree(self, {}, keep_program=True)])[0]
+
+    def compile(self):
+        '''
+        返回等价的 R, 其中可编译的子树由 NFA/DFA 线性时间匹配, 其余部分照常回溯
+        '''
+        if self.store is not None:
+            return self.store.compile(self)
+        from .nfa import compile_tree
+        from .optimize import attach_dispatch, intern_trees
+        this = intern_trees([compile_tree(self.optimize())])[0]
+        attach_dispatch([this])
+        this.optimized = this
+        return this
+
+    def codegen(self):
+        '''
+        返回为 self 生成并 exec 的专用匹配函数, 结果缓存在 self.generated 中
+        source 为生成的源码, imatch/finditer/match 与 R 的同名方法结果相同, 见 codegen.py
+        '''
+        if self.generated is None:
+            from .codegen import Generated
+            self.generated = Generated(self.optimize())
+        return self.generated
+
     # --- core ---
     @cache_deco
-    def imatch(self, resource: str, prev_result: Result):
+    def imatch(self, resource: str, prev_result: Result, ctx: Context = None, end: int = None):
         '''
-        参数: 字符串(resource), 上一个状态机的结果(prev_result)
+        参数: 字符串(resource), 上一个状态机的结果(prev_result), 缓存上下文(ctx), 匹配的右边界(end)
         返回 iter, 按模式 yield 所有结果
 
         正则匹配可以看成图论, imatch 就像节点用 stream 或者说 pipe 连接
         '''
+        if self.program:
+            ends = self.program.ends(resource, prev_result.ed, end, ctx)
+            if ends is not None:
+                for ed in ends:
+                    yield Success(prev_result.op, ed, prev_result.spans)
+                return
+            # 函数返回了 BranchStop, 回退到逐节点匹配
+
+        if self.dispatch is not None:
+            # 只尝试可能以下一个字符开头的分支, 顺序不变; 到达 end 时尝试所有分支
+            table, default, branches = self.dispatch
+            pos = prev_result.ed
+            if pos < end:
+                branches = table.get(resource[pos], default)
+                if pos + 1 > ctx.reach:
+                    ctx.reach = pos + 1
+            elif end == len(resource):
+                ctx.at_end()
+            stream4logic = chain.from_iterable(branch.imatch(resource, prev_result, ctx, end) for branch in branches)
+            if self.next_r:
+                yield from chain.from_iterable(self.next_r.imatch(resource, echo, ctx, end) for echo in filter(bool, stream4logic))
+            else:
+                yield from stream4logic
+            return
+
         # 约定: from_num 和 to_num 在匹配开始时就已经确定
         from_num, to_num = explain_n(prev_result, self.num_t)
 
@@ -136,45 +264,87 @@ class R:
             '''
             nonlocal prev_ed
             if self.name and echo:
-                group = echo.capture.get(self.name, ())
-                echo.capture = {**echo.capture, self.name: [*group, (prev_ed, echo.ed)]}
+                echo.capture_add(self.name, prev_ed, echo.ed)
                 prev_ed = echo.ed
             return echo
 
-        if self.gen:
-            # 已递归到最里层
+        if self.gen and self.mode is Mode.lazy:
+            # 已递归到最里层, 懒惰模式每次只多匹配一次
             def stream4num():
                 if from_num == 0:
                     # 可选匹配
                     yield prev_result
-                if to_num == 0:
-                    # 不会匹配到更多
-                    return
 
                 counter = 0
-                fa = self.gen(prev_result)
-                next(fa)
-                for char in resource[prev_result.ed:]:
-                    echo = fa.send(char)
-
-                    if echo == 'GO':
-                        continue
-                    elif isinstance(echo, Success):
-                        counter += 1
-                        capture_add(echo)
-                        if from_num <= counter <= to_num:
-                            yield echo
-                        if counter < to_num:
-                            # 未到达边界, 置换 fa
-                            fa = self.gen(echo)
-                            next(fa)
-                        else:
-                            return
-                    elif isinstance(echo, Fail):
-                        yield echo
+                ed = prev_result.ed
+                spans = prev_result.spans
+                while counter < to_num:
+                    n, fail_ed = self.gen(resource, ed, end, 1, prev_result.op, ctx)
+                    if ctx.profile is not None:
+                        stop = fail_ed if fail_ed is not None else min(end, ed + self.gen.width)
+                        ctx.profile.of(self).chars += stop - ed
+                    if fail_ed is not None:
+                        if fail_ed > ctx.reach:
+                            ctx.reach = fail_ed
+                        yield Fail(prev_result.op, fail_ed, spans)
+                        return
+                    if not n:
+                        # 输入耗尽
+                        reach = end
+                        if end == len(resource):
+                            ctx.at_end()
+                            reach += 1
+                        if reach > ctx.reach:
+                            ctx.reach = reach
                         return
+                    if ed + self.gen.width > ctx.reach:
+                        ctx.reach = ed + self.gen.width
+                    counter += 1
+                    ed += self.gen.width
+                    echo = capture_add(Success(prev_result.op, ed, spans))
+                    spans = echo.spans
+                    if from_num <= counter:
+                        yield echo
 
-            stream4num = stream4num() if self.mode is Mode.lazy else reversed(tuple(stream4num()))
+            stream4num = stream4num()
+        elif self.gen:
+            # 已递归到最里层, 贪婪模式先求出最长的重复次数, 回溯时再依次给出更少的次数
+            def stream4num():
+                pos = prev_result.ed
+                n, fail_ed = self.gen(resource, pos, end, to_num, prev_result.op, ctx) if to_num else (0, None)
+                width = self.gen.width
+                # 读取过的最远位置
+                reach = pos + n * width
+                if fail_ed is not None:
+                    reach = fail_ed
+                elif n < to_num:
+                    reach = end
+                    if end == len(resource):
+                        # 输入耗尽
+                        ctx.at_end()
+                        reach += 1
+                if reach > ctx.reach:
+                    ctx.reach = reach
+                if ctx.profile is not None:
+                    ctx.profile.of(self).chars += min(reach, end) - pos
+
+                spans = prev_result.spans
+                if self.name:
+                    # 只构建一次最长的捕获链, 更少次数的捕获链沿 prev 取得
+                    for counter in range(n):
+                        spans = Span(spans, self.name, pos + counter * width, pos + (counter + 1) * width)
+
+                if fail_ed is not None:
+                    yield Fail(prev_result.op, fail_ed, spans)
+                for counter in range(n, max(from_num, 1) - 1, -1):
+                    yield Success(prev_result.op, pos + counter * width, spans)
+                    if self.name:
+                        spans = spans.prev
+                if from_num == 0:
+                    # 可选匹配
+                    yield prev_result
+
+            stream4num = stream4num()
         else:
             def stream4num():
                 if to_num == 0:
@@ -185,10 +355,18 @@ class R:
 
                 # DFS
                 counter = 1
-                curr_iter = self.target.imatch(resource, prev_result)
+                curr_iter = self.target.imatch(resource, prev_result, ctx, end)
+                unit = self.target.bounds[0]
+
+                def step(curr_iter, need: int):
+                    for i in curr_iter:
+                        # 之后还需 need 个字符才能完成 from_num 次重复, 剩余的不够时不必继续
+                        if i and end - i.ed >= need:
+                            yield from self.target.imatch(resource, i, ctx, end)
+
                 while counter < from_num:
                     counter += 1
-                    curr_iter = chain.from_iterable(self.target.imatch(resource, i) for i in curr_iter if i)
+                    curr_iter = step(curr_iter, (from_num - counter) * unit)
 
                 q = deque()
                 q.append((curr_iter, counter))
@@ -201,14 +379,16 @@ class R:
                         if self.mode is Mode.lazy:
                             yield echo
                             if echo and nth < to_num:
-                                q.append((self.target.imatch(resource, echo), nth + 1))
+                                q.append((self.target.imatch(resource, echo, ctx, end), nth + 1))
                         else:
                             if echo and nth < to_num:
-                                q.append((self.target.imatch(resource, echo), nth + 1, echo))
+                                q.append((self.target.imatch(resource, echo, ctx, end), nth + 1, echo))
                             else:
                                 yield echo
                     except StopIteration:
                         q.pop()
+                        if ctx.profile is not None:
+                            ctx.profile.of(self).backtracks += 1
                         if len(last) == 3:
                             yield last[-1]
 
@@ -224,30 +404,31 @@ class R:
                     if not echo:
                         yield echo
                     else:
-                        echo.as_fail()
-                        for and_echo in self.and_r.imatch(resource[prev_result.ed:echo.ed], Result(0, 0)):
-                            if and_echo and and_echo.ed == echo.ed - prev_result.ed:
+                        echo = echo.clone().as_fail()
+                        # 在 [prev_result.ed, echo.ed) 的窗口内原地匹配
+                        for and_echo in self.and_r.imatch(resource, Result(prev_result.ed, prev_result.ed), ctx, echo.ed):
+                            if and_echo and and_echo.ed == echo.ed:
                                 echo.as_success()
                                 break
                         yield echo
 
         elif self.or_r:
             def stream4logic():
-                yield from chain(stream4num, self.or_r.imatch(resource, prev_result))
+                yield from chain(stream4num, self.or_r.imatch(resource, prev_result, ctx, end))
 
         elif self.invert:
             def stream4logic():
                 for echo in stream4num:
-                    yield echo.invert()
+                    yield echo.clone().invert()
 
         elif self.xor_r:
             def stream4logic():
                 for echo in stream4num:
                     demand_bool = not bool(echo)
-                    echo.as_fail()
+                    echo = echo.clone().as_fail()
 
-                    for xor_echo in self.xor_r.imatch(resource[prev_result.ed:echo.ed], Result(0, 0)):
-                        if bool(xor_echo) is demand_bool and xor_echo.ed == echo.ed - prev_result.ed:
+                    for xor_echo in self.xor_r.imatch(resource, Result(prev_result.ed, prev_result.ed), ctx, echo.ed):
+                        if bool(xor_echo) is demand_bool and xor_echo.ed == echo.ed:
                             yield echo.as_success()
                             break
                     else:
@@ -260,22 +441,214 @@ class R:
         stream4logic = stream4logic()
 
         if self.next_r:
-            yield from chain.from_iterable(self.next_r.imatch(resource, echo) for echo in filter(bool, stream4logic))
+            yield from chain.from_iterable(self.next_r.imatch(resource, echo, ctx, end) for echo in filter(bool, stream4logic))
         else:
             yield from stream4logic
 
-    def match(self, resource: str):
-        output_l = []
+    def finditer(self, resource: str, ctx: Context = None, max_steps: int = None, timeout: float = None):
+        '''
+        按顺序 yield 不重叠的匹配结果, 调用方停止迭代时不再做多余的工作
+        不传入 ctx 时每次调用使用独立的缓存上下文, 缓存随游标滑动释放, 迭代结束或关闭时清空
+        imatch 的调用次数超过 max_steps 或耗时超过 timeout 秒时抛出 MatchLimit, 见 Context.arm
+        '''
+        pattern = self.optimize()
+        own = ctx is None
+        ctx = Context() if own else ctx
+        ctx.arm(max_steps, timeout)
+        # 跳过不可能开始匹配的位置
+        seek = seeker(pattern)
+        # 剩余的字符少于 min_len 的位置不可能开始匹配
+        limit = len(resource) - max(pattern.bounds[0], 1) + 1
         cursor = Result(0, 0)
-        while cursor.ed < len(resource):
-            for echo in self.imatch(resource, cursor):
-                if echo:
-                    output_l.append(echo)
-                    op = max(echo.ed, cursor.ed + 1)
-                    cursor = Result(op, op)
-                    break
-            else:
-                cursor.op += 1
-                cursor.ed += 1
-        cache_clear()
+        try:
+            while cursor.ed < limit:
+                if seek:
+                    op = seek(resource, cursor.ed)
+                    if op < 0:
+                        break
+                    if op > cursor.ed:
+                        cursor = Result(op, op)
+                # 游标之前的缓存不会再用到
+                ctx.evict(cursor.ed)
+                op = cursor.ed + 1
+                for echo in pattern.imatch(resource, cursor, ctx):
+                    if echo:
+                        yield echo
+                        op = max(echo.ed, op)
+                        break
+                cursor = Result(op, op)
+        except MatchLimit as ml:
+            ml.args = (cursor.ed, min(max(ctx.reach, cursor.ed), len(resource)))
+            # 中断的 imatch 留下了不完整的缓存
+            ctx.clear()
+            raise
+        finally:
+            if own:
+                ctx.clear()
+
+    def match(self, resource: str, ctx: Context = None, max_steps: int = None, timeout: float = None):
+        '''
+        返回 finditer 的所有结果, 抛出 MatchLimit 时已确定的结果保存在其 results 中
+        '''
+        output_l = []
+        try:
+            for echo in self.finditer(resource, ctx, max_steps, timeout):
+                output_l.append(echo)
+        except MatchLimit as ml:
+            ml.results = output_l
+            raise
         return output_l
+
+    def search(self, resource: str, ctx: Context = None, max_steps: int = None, timeout: float = None):
+        '''
+        返回第一个匹配结果, 没有则为 None
+        '''
+        it = self.finditer(resource, ctx, max_steps, timeout)
+        try:
+            return next(it, None)
+        finally:
+            it.close()
+
+    def fullmatch(self, resource: str, ctx: Context = None, max_steps: int = None, timeout: float = None):
+        '''
+        返回从 0 开始, 到 resource 末尾结束的第一个结果, 没有则为 None
+        '''
+        pattern = self.optimize()
+        min_len, max_len = pattern.bounds
+        if not min_len <= len(resource) <= max_len:
+            return None
+        seek = seeker(pattern)
+        if seek and seek(resource, 0) != 0:
+            return None
+        own = ctx is None
+        ctx = Context() if own else ctx
+        ctx.arm(max_steps, timeout)
+        it = pattern.imatch(resource, Result(0, 0), ctx)
+        try:
+            for echo in it:
+                if echo and echo.ed == len(resource):
+                    return echo
+            return None
+        except MatchLimit as ml:
+            ml.args = (0, min(ctx.reach, len(resource)))
+            ctx.clear()
+            raise
+        finally:
+            it.close()
+            if own:
+                ctx.clear()
+
+    def profile(self, resource: str):
+        '''
+        按节点统计 match(resource) 的开销, 返回 Profile, 用 report() 查看或用 dump() 导出
+        统计的是实际执行的改写后的节点, 见 optimize
+        '''
+        from .profile import Profile
+        profile = Profile()
+        self.match(resource, Context(profile=profile))
+        return profile
+
+    def match_parallel(self, resource: str, workers: int = None, max_len=None, chunk_size: int = None):
+        '''
+        把 resource 切块后在 workers 个进程中匹配, 结果与 match 相同
+        max_len 为一次匹配读取的字符数的上界, 默认由静态分析求出; 无界时退回 match
+        '''
+        from .parallel import match_parallel
+        return match_parallel(self, resource, workers, max_len, chunk_size)
+
+    def match_many(self, documents, workers: int = None, batch: int = 64):
+        '''
+        在 workers 个进程中逐个匹配 documents, 按顺序 yield 每个文档的 match 结果
+        每个进程只接收一次 R, 文档按 batch 个一组分发
+        '''
+        from .parallel import match_many
+        return match_many(self, documents, workers, batch)
+
+    def match_stream(self, fileobj, chunk_size: int = 1 << 16, encoding: str = 'utf-8', ctx: Context = None,
+                     max_steps: int = None, timeout: float = None):
+        '''
+        从文本/二进制文件对象或 mmap 中分块读取, 按顺序 yield 与 match 相同的结果, 位置为整个输入中的绝对坐标
+        bytes 按 encoding 增量解码, 位置以解码后的字符计
+        max_steps 和 timeout 限制整个流的匹配, 抛出 MatchLimit 时已交出的结果保存在其 results 中
+
+        缓冲区只保留游标之后的内容; 一次尝试读到缓冲区末尾时, 结果可能随后续输入改变,
+        此时立即中止这次尝试, 读入更多内容并从同一游标重试, 否则结果已确定, 立即 yield
+        '''
+        pattern = self.optimize()
+        ctx = ctx if ctx is not None else Context()
+        ctx.arm(max_steps, timeout)
+        seek = seeker(pattern)
+        # 已交出的结果
+        output_l = []
+        decoder = None
+        buf = ''
+        # buf[0] 在整个输入中的位置
+        base = 0
+        # buf 内的游标
+        cursor = 0
+        eof = False
+
+        def more():
+            nonlocal decoder, buf, base, cursor, eof
+            # 每次至少读入缓冲区现有的长度, 重试的总开销为线性
+            raw = fileobj.read(max(chunk_size, len(buf) - cursor))
+            if isinstance(raw, str):
+                chunk = raw
+            else:
+                if decoder is None:
+                    decoder = getincrementaldecoder(encoding)()
+                chunk = decoder.decode(raw, final=not raw)
+            eof = not raw
+            base += cursor
+            buf = buf[cursor:] + chunk
+            cursor = 0
+            # 缓存的 k 引用了旧的 buf, 位置也已改变
+            ctx.clear()
+
+        while True:
+            if cursor >= len(buf):
+                if eof:
+                    return
+                more()
+                continue
+            if seek:
+                op = seek(buf, cursor)
+                if op < 0:
+                    if eof:
+                        return
+                    # 可能开始匹配的位置跨越缓冲区末尾
+                    cursor = max(cursor, len(buf) - seek.width + 1)
+                    more()
+                    continue
+                cursor = op
+            ctx.evict(cursor)
+
+            found = None
+            ctx.stream_open = not eof
+            try:
+                for echo in pattern.imatch(buf, Result(cursor, cursor), ctx):
+                    if echo:
+                        found = echo
+                        break
+            except _NeedMore:
+                # 尝试读到了缓冲区末尾, 不必继续回溯
+                more()
+                continue
+            except BranchStop as bs:
+                bs.args = tuple(i + base for i in bs.args)
+                raise
+            except MatchLimit as ml:
+                ml.args = (base + cursor, base + min(max(ctx.reach, cursor), len(buf)))
+                ml.results = output_l
+                # 中断的 imatch 留下了不完整的缓存
+                ctx.clear()
+                raise
+            finally:
+                ctx.stream_open = False
+
+            if found:
+                output_l.append(found.shift(base))
+                yield output_l[-1]
+                cursor = max(found.ed, cursor + 1)
+            else:
+                cursor += 1
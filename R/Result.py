@@ -1,43 +1,139 @@
-from copy import copy
 from pprint import pformat
 
+# 指纹取 64 位
+MASK = (1 << 64) - 1
+
+
+class Span:
+    '''
+    捕获组的持久化链表, 每个节点记录一次捕获 (name, op, ed)
+    新增捕获只需创建一个节点, 与之前的结果共享前缀
+
+    指纹 fp 随节点增量更新: 各次捕获 (name, 组内序号, op, ed) 的散列之和,
+    与捕获的先后交错无关, 只取决于 dict 视图; 指纹相同时才比较完整内容
+    '''
+    __slots__ = ('prev', 'name', 'op', 'ed', 'counts', 'fp', '_dict')
+
+    def __init__(self, prev: 'Span', name: str, op: int, ed: int):
+        self.prev = prev
+        self.name = name
+        self.op = op
+        self.ed = ed
+        # {..., name: 捕获次数}, 只复制组名个数的条目
+        counts = prev.counts if prev is not None else {}
+        nth = counts.get(name, 0)
+        self.counts = {**counts, name: nth + 1}
+        self.fp = ((prev.fp if prev is not None else 0) + hash((name, nth, op, ed))) & MASK
+        # 惰性计算
+        self._dict = None
+
+    def __hash__(self):
+        return self.fp
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Span) or self.fp != other.fp or self.counts != other.counts:
+            return False
+        return self.to_dict() == other.to_dict()
+
+    def to_dict(self):
+        '''
+        {..., name: [... (op, ed)]}
+        '''
+        if self._dict is None:
+            events = []
+            node = self
+            while node is not None:
+                events.append(node)
+                node = node.prev
+            d = {}
+            for node in reversed(events):
+                d.setdefault(node.name, []).append((node.op, node.ed))
+            self._dict = d
+        return self._dict
+
+    @staticmethod
+    def from_dict(capture: dict):
+        node = None
+        for name, group in capture.items():
+            for op, ed in group:
+                node = Span(node, name, op, ed)
+        return node
+
 
 class Result:
     '''
     记录字符串已匹配的开始和结束, 以及沿途捕获的组
     '''
+    __slots__ = ('op', 'ed', 'spans')
 
-    def __init__(self, op: int, ed: int, capture: dict = None):
+    def __init__(self, op: int, ed: int, capture=None):
         self.op = op
         self.ed = ed
-        # {..., name: [... (op, ed)]}
-        self._capture = capture if capture is not None else {}
+        # capture 可以是 dict 或 Span 链表
+        self.spans = Span.from_dict(capture) if isinstance(capture, dict) else capture
 
-        self._hash = 0
-        self.update = True
+    def __reduce__(self):
+        # 捕获组以 dict 序列化, 避免链表过长时递归过深
+        return self.__class__, (self.op, self.ed, self.capture)
 
     def __repr__(self):
         return 'Result({}, {}, {})'.format(self.op, self.ed, pformat(self.capture))
 
     @property
     def capture(self):
-        return self._capture
+        return self.spans.to_dict() if self.spans is not None else {}
 
     @capture.setter
     def capture(self, val: dict):
-        self.update = True
-        self._capture = val
+        self.spans = Span.from_dict(val)
+
+    def capture_add(self, name: str, op: int, ed: int):
+        '''
+        O(1) 添加一次捕获
+        '''
+        self.spans = Span(self.spans, name, op, ed)
+        return self
+
+    def count(self, name: str):
+        '''
+        名为 name 的捕获组的长度
+        '''
+        return self.spans.counts.get(name, 0) if self.spans is not None else 0
 
     @property
     def hash(self):
-        if self.update:
-            self.update = False
-            self._hash = str(sorted(self.capture.items()))
-        return self._hash
+        '''
+        作为缓存 k 的一部分, 按指纹散列, 冲突时才比较完整内容
+        '''
+        return self.spans
+
+    def at(self, op: int):
+        '''
+        op 替换后的副本, 供缓存重放使用
+        '''
+        this = object.__new__(self.__class__)
+        this.op = op
+        this.ed = self.ed
+        this.spans = self.spans
+        return this
+
+    def shift(self, delta: int):
+        '''
+        所有位置平移 delta 后的副本
+        '''
+        capture = None
+        if self.spans is not None:
+            capture = {name: [(op + delta, ed + delta) for op, ed in group] for name, group in self.capture.items()}
+        return self.__class__(self.op + delta, self.ed + delta, capture)
 
     def clone(self, **kwargs):
-        this = copy(self)
-        for k, v in kwargs:
+        this = object.__new__(self.__class__)
+        this.op = self.op
+        this.ed = self.ed
+        this.spans = self.spans
+        for k, v in kwargs.items():
             setattr(this, k, v)
         return this
 
@@ -50,13 +146,18 @@ class Result:
         self.__class__ = Fail
         return self
 
-
-class Success(Result):
+    # 未标记的 Result 视为成功
     def invert(self):
         return self.as_fail()
 
 
+class Success(Result):
+    __slots__ = ()
+
+
 class Fail(Result):
+    __slots__ = ()
+
     def __bool__(self):
         return False
 
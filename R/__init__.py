@@ -1,4 +1,10 @@
 from .R import R, Mode, RecursionWrapper
-from .util import BranchStop
+from .cache import Context
+from .charclass import CharClass
+from .diskcache import PatternCache
+from .profile import Profile
+from .rset import RSet
+from .session import MatchSession
+from .util import BranchStop, MatchLimit
 
 r = R
@@ -0,0 +1,278 @@
+'''
+R 树的静态分析, 供匹配前的预处理使用
+'''
+import re
+from math import inf
+
+from .charclass import CharClass
+
+if False:
+    # 仅用于类型检查
+    from .R import R
+
+
+def sub_r(node: 'R'):
+    '''
+    非叶节点的子 R, RecursionWrapper 未赋值时为 None
+    '''
+    if node.gen:
+        return None
+    target = node.target
+    return target if hasattr(target, 'imatch') else None
+
+
+def const_n(node: 'R'):
+    '''
+    常数数量条件返回 (from_num, to_num), 由捕获组决定的返回 None
+    '''
+    from_num, to_num = node.num_t
+    if isinstance(from_num, int) and (isinstance(to_num, int) or to_num == inf):
+        return from_num, to_num
+    return None
+
+
+def walk(root: 'R'):
+    '''
+    yield 所有可达节点, 每个节点一次
+    '''
+    seen = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node is None or id(node) in seen:
+            continue
+        seen.add(id(node))
+        yield node
+        stack.extend((sub_r(node), node.and_r, node.or_r, node.xor_r, node.next_r))
+
+
+def solve(root: 'R', rule, bottom, widen=None):
+    '''
+    求最小不动点, 返回 (所有节点, {..., id(node): 值}), RecursionWrapper 形成的环由迭代收敛
+    rule(node, get) 通过 get(child) 读取子节点当前的值
+    值可能无限增长时传入 widen(旧值, 新值): 迭代的轮数超过节点数后, 仍在变化的值改取 widen 的结果
+    '''
+    nodes = list(walk(root))[::-1]
+    values = {id(node): bottom for node in nodes}
+
+    def get(node):
+        return values[id(node)]
+
+    rounds = 0
+    changed = True
+    while changed:
+        changed = False
+        rounds += 1
+        for node in nodes:
+            val = rule(node, get)
+            old = values[id(node)]
+            if val != old:
+                if widen is not None and rounds > len(nodes):
+                    val = widen(old, val)
+                    if val == old:
+                        continue
+                values[id(node)] = val
+                changed = True
+    return nodes, values
+
+
+def fixpoint(root: 'R', rule, bottom, widen=None):
+    '''
+    root 的值, 见 solve
+    '''
+    return solve(root, rule, bottom, widen)[1][id(root)]
+
+
+def first_rule(node: 'R', get):
+    '''
+    (chars, nullable): 成功的匹配可能以哪些字符开头, None 表示未知; 能否成功匹配空串
+    '''
+    if node.invert or node.xor_r:
+        return None, True
+
+    num = const_n(node)
+    if num and num[1] == 0:
+        chars, nullable = frozenset(), True
+    else:
+        may_zero = num is None or num[0] == 0
+        if node.gen:
+            if isinstance(node.target, str):
+                chars, nullable = frozenset(node.target[:1]), may_zero or not node.target
+            elif isinstance(node.target, CharClass):
+                chars, nullable = node.target.finite(), may_zero
+            else:
+                chars, nullable = None, may_zero
+        else:
+            target = sub_r(node)
+            if target is None:
+                return None, True
+            chars, nullable = get(target)
+            nullable = nullable or may_zero
+
+    if node.or_r:
+        or_chars, or_nullable = get(node.or_r)
+        chars = None if chars is None or or_chars is None else chars | or_chars
+        nullable = nullable or or_nullable
+
+    if node.next_r and nullable:
+        next_chars, nullable = get(node.next_r)
+        chars = None if chars is None or next_chars is None else chars | next_chars
+    return chars, nullable
+
+
+def first_set(node: 'R'):
+    '''
+    返回 (chars, nullable), 见 first_rule
+    '''
+    return fixpoint(node, first_rule, (frozenset(), False))
+
+
+def bounds_rule(node: 'R', get):
+    '''
+    (min_len, max_len)
+    min_len: 成功的结果的长度的下界
+    max_len: 从开始位置起, 一次匹配读取的字符数和结果(包括 Fail)的长度的上界, 无界时为 inf
+    & 的结果同时是 and_r 的成功结果; & 和 ^ 只在结果的窗口内匹配; ~ 和 ^ 的成功可能来自 Fail, 长度不定
+    '''
+    num = const_n(node)
+    if num is None:
+        lo, hi = 0, inf
+    elif num[1] == 0:
+        lo, hi = 0, 0
+    else:
+        if node.gen:
+            unit = len(node.target) if isinstance(node.target, str) else 1
+            unit_lo, unit_hi = unit, unit
+        else:
+            target = sub_r(node)
+            unit_lo, unit_hi = get(target) if target is not None else (0, inf)
+        lo = unit_lo * num[0]
+        hi = unit_hi * num[1] if unit_hi else 0
+
+    if node.and_r:
+        lo = max(lo, get(node.and_r)[0])
+    elif node.invert or node.xor_r:
+        lo = 0
+    elif node.or_r:
+        or_lo, or_hi = get(node.or_r)
+        lo, hi = min(lo, or_lo), max(hi, or_hi)
+    if node.next_r:
+        next_lo, next_hi = get(node.next_r)
+        lo, hi = lo + next_lo, hi + next_hi
+    return lo, hi
+
+
+def widen_bounds(old: tuple, new: tuple):
+    # 迭代值都是 min_len 的下界, 停在旧值即可; max_len 仍在增长说明无界
+    return old[0], inf
+
+
+def bounds(node: 'R'):
+    '''
+    返回 (min_len, max_len), 见 bounds_rule
+    结果缓存在各节点的 _bounds 中
+    '''
+    cached = getattr(node, '_bounds', None)
+    if cached is not None:
+        return cached
+    nodes, values = solve(node, bounds_rule, (0, 0), widen_bounds)
+    for i in nodes:
+        if getattr(i, '_bounds', None) is None:
+            i._bounds = values[id(i)]
+    return values[id(node)]
+
+
+def min_len(node: 'R'):
+    return bounds(node)[0]
+
+
+def max_len(node: 'R'):
+    return bounds(node)[1]
+
+
+def required_prefix(node: 'R', active: set = None):
+    '''
+    返回 (prefix, exact): 所有成功的匹配都以 prefix 开头; exact 表示只能匹配 prefix 本身
+    '''
+    active = active if active is not None else set()
+    if node.invert or node.xor_r or id(node) in active:
+        return '', False
+    active.add(id(node))
+
+    num = const_n(node)
+    if num is None:
+        prefix, exact = '', False
+    elif num[1] == 0:
+        prefix, exact = '', True
+    else:
+        if node.gen:
+            unit, unit_exact = (node.target, True) if isinstance(node.target, str) else ('', False)
+        else:
+            target = sub_r(node)
+            unit, unit_exact = required_prefix(target, active) if target else ('', False)
+        if unit_exact:
+            prefix, exact = unit * num[0], num[0] == num[1]
+        else:
+            prefix, exact = unit if num[0] else '', False
+
+    if node.and_r:
+        exact = False
+    elif node.or_r:
+        or_prefix, or_exact = required_prefix(node.or_r, active)
+        exact = exact and or_exact and prefix == or_prefix
+        i = 0
+        while i < min(len(prefix), len(or_prefix)) and prefix[i] == or_prefix[i]:
+            i += 1
+        prefix = prefix[:i]
+
+    if node.next_r and exact:
+        next_prefix, exact = required_prefix(node.next_r, active)
+        prefix += next_prefix
+
+    active.discard(id(node))
+    return prefix, exact
+
+
+def leading_leaf(node: 'R'):
+    '''
+    所有成功的匹配都以其一次匹配开头的叶节点的目标(CharClass 或函数), 没有时返回 None
+    '''
+    seen = set()
+    while node is not None and id(node) not in seen:
+        seen.add(id(node))
+        num = const_n(node)
+        if node.and_r or node.or_r or node.invert or node.xor_r or num is None or num[0] < 1:
+            return None
+        if node.gen:
+            return node.target if callable(node.target) else None
+        node = sub_r(node)
+    return None
+
+
+def seeker(node: 'R'):
+    '''
+    返回 seek(resource, pos): pos 之后第一个可能开始匹配的位置, 没有则为 -1
+    seek.width 为判断一个位置需要的字符数; 无法排除任何位置时返回 None
+    '''
+    chars, nullable = first_set(node)
+    if nullable:
+        return None
+
+    prefix, _ = required_prefix(node)
+    if prefix:
+        def seek(resource: str, pos: int):
+            return resource.find(prefix, pos)
+
+        seek.width = len(prefix)
+        return seek
+
+    if chars is not None:
+        search = re.compile('[{}]'.format(''.join(map(re.escape, sorted(chars))))).search if chars else None
+
+        def seek(resource: str, pos: int):
+            found = search(resource, pos) if search else None
+            return found.start() if found else -1
+
+        seek.width = 1
+        return seek
+    return None
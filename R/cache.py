@@ -1,14 +1,117 @@
+from collections import OrderedDict
+from time import perf_counter
+
+from .util import MatchLimit, _NeedMore
+
 if False:
     # 仅用于类型检查
     from .Result import Result
     from .R import R
+    from .profile import Profile
+
+
+class Context:
+    '''
+    一次匹配的缓存上下文, 由 imatch 逐层传递
+    不同的 match 互不干扰, 也可以有意在同一个 resource 的多次 match 间复用
+
+    slide: match 的游标前进后, 丢弃位置在游标之前的缓存, 复用时需设为 False
+    max_entries: 缓存条目的上限, 超过后按 LRU 淘汰
+    profile: 传入 Profile 时按节点统计开销, 见 profile.py
+    max_steps: 一次匹配中 imatch 的调用次数的上限, 超出时抛出 MatchLimit
+    timeout: 一次匹配的秒数上限, 超出时抛出 MatchLimit
+    '''
+
+    def __init__(self, slide: bool = True, max_entries: int = None, profile: 'Profile' = None,
+                 max_steps: int = None, timeout: float = None):
+        self.slide = slide
+        self.max_entries = max_entries
+        self.profile = profile
+        self.max_steps = max_steps
+        self.timeout = timeout
+        # 是否需要计步, 见 arm
+        self.limited = False
+        self.steps = 0
+        self.deadline = None
+        # {..., k: [share_l, share_iter, reach]}
+        self.memo = OrderedDict() if max_entries is not None else {}
+        # {..., pos: [... k]}
+        self.by_pos = {}
+        self.low = 0
+        # 是否有匹配因读到 resource 末尾而停止, 流式匹配据此判断是否需要更多输入
+        self.hit_end = False
+        # 流式匹配尚未读完输入, 此时读到 resource 末尾立即中止本次尝试, 见 at_end
+        self.stream_open = False
+        # 当前的 imatch 读取过的最远位置(不含), 读到 resource 末尾时为 len(resource) + 1, 见 MatchSession
+        self.reach = 0
+        # {..., CharClass: (resource, 标记, 表示非成员的值)}, 见 CharClass.mask
+        self.masks = {}
+
+    def lookup(self, k: tuple):
+        entry = self.memo.get(k)
+        if entry is not None and self.max_entries is not None:
+            self.memo.move_to_end(k)
+        return entry
+
+    def store(self, k: tuple, entry: list):
+        self.memo[k] = entry
+        pos = k[2]
+        if self.slide:
+            self.by_pos.setdefault(pos, []).append(k)
+        if self.max_entries is not None and len(self.memo) > self.max_entries:
+            # 正在使用的条目被淘汰也无妨, 消费者持有自己的引用, 再次查询时重新计算
+            self.memo.popitem(last=False)
+
+    def arm(self, max_steps: int = None, timeout: float = None):
+        '''
+        一次匹配开始时重新计步并设置截止时间, 传入的值覆盖构造时的设置
+        '''
+        if max_steps is not None:
+            self.max_steps = max_steps
+        if timeout is not None:
+            self.timeout = timeout
+        self.steps = 0
+        self.deadline = perf_counter() + self.timeout if self.timeout is not None else None
+        self.limited = self.max_steps is not None or self.deadline is not None
+
+    def tick(self):
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise MatchLimit()
+        # 每 64 步检查一次时间
+        if self.deadline is not None and not self.steps & 63 and perf_counter() > self.deadline:
+            raise MatchLimit()
 
-# {..., k: (share_l, share_iter)}
-cache = {}
+    def at_end(self):
+        '''
+        匹配读到了 resource 末尾, 流式匹配尚未读完输入时抛出 _NeedMore
+        '''
+        self.hit_end = True
+        if self.stream_open:
+            raise _NeedMore()
 
+    def evict(self, cursor: int):
+        '''
+        游标只会前进, 位置在 cursor 之前的缓存不会再被查询
+        '''
+        if not self.slide or cursor <= self.low:
+            return
+        if cursor - self.low > len(self.by_pos):
+            stale = [pos for pos in self.by_pos if pos < cursor]
+        else:
+            stale = range(self.low, cursor)
+        for pos in stale:
+            for k in self.by_pos.pop(pos, ()):
+                self.memo.pop(k, None)
+        self.low = cursor
 
-def cache_clear():
-    cache.clear()
+    def clear(self):
+        self.memo.clear()
+        self.by_pos.clear()
+        self.low = 0
+        self.hit_end = False
+        self.reach = 0
+        self.masks.clear()
 
 
 def cache_deco(imatch):
@@ -16,21 +119,45 @@ def cache_deco(imatch):
     缓存 R 中 imatch 的修饰器
     '''
 
-    def memo_imatch(self: 'R', resource: str, prev_result: 'Result'):
-        def recursion_correct(result: 'Result'):
-            result.op = max(result.op, prev_result.op)
-            return result
+    def memo_imatch(self: 'R', resource: str, prev_result: 'Result', ctx: Context = None, end: int = None):
+        if ctx is None:
+            ctx = Context()
+        if end is None:
+            end = len(resource)
+        if ctx.limited:
+            ctx.tick()
 
-        k = (id(self), prev_result.ed, prev_result.hash)
-        share_l, share_iter = cache.setdefault(k, ([], imatch(self, resource, prev_result)))
-        yield from map(lambda echo: recursion_correct(echo.clone(op=prev_result.ed)), share_l)
+        # 结果的 op 总是沿用 prev_result.op, 因此不参与 k; 位置都是 resource 上的绝对坐标
+        k = (id(self), resource, prev_result.ed, end, prev_result.hash)
+        entry = ctx.lookup(k)
+        profile = ctx.profile
+        if profile is not None:
+            profile.call(self, entry is not None)
+        if entry is None:
+            # [share_l, share_iter, 推进 share_iter 时读取过的最远位置]
+            entry = [[], imatch(self, resource, prev_result, ctx, end), 0]
+            ctx.store(k, entry)
+        share_l, share_iter, _ = entry
 
+        # 按下标读取 share_l, 嵌套的消费者推进 share_iter 后不会漏掉结果
+        i = 0
         while True:
-            try:
-                echo = next(share_iter)
-            except StopIteration:
-                break
-            share_l.append(echo)
-            yield recursion_correct(echo)
+            if i == len(share_l):
+                # 单独统计本条目读取的范围, 之后复用条目的消费者同样依赖这些内容
+                outer = ctx.reach
+                ctx.reach = 0
+                try:
+                    share_l.append(next(share_iter) if profile is None else profile.advance(self, share_iter))
+                except StopIteration:
+                    break
+                finally:
+                    if ctx.reach > entry[2]:
+                        entry[2] = ctx.reach
+                    ctx.reach = max(outer, entry[2])
+            elif entry[2] > ctx.reach:
+                ctx.reach = entry[2]
+            # share_l 中保留原样, 交出副本供下游修改
+            yield share_l[i].at(prev_result.op)
+            i += 1
 
     return memo_imatch
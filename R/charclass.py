@@ -0,0 +1,181 @@
+'''
+可序列化的字符类, 作为 R 的匹配目标代替 lambda
+
+判断结果按码位缓存在查找表中, 查找表同时是 str.translate 的映射表;
+resource 较长时, 一次 translate 得到整段的成员标记, 之后的成员判断和连续匹配都在标记上用 find 完成
+安装了 NumPy 时标记由向量化的查表得到
+'''
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def is_word(char: str):
+    return char.isalnum() or char == '_'
+
+
+def is_any(char: str):
+    return True
+
+
+# 预定义类, 按名字引用, 序列化时只保存名字
+CLASSES = {
+    'digit': str.isdigit,
+    'space': str.isspace,
+    'alpha': str.isalpha,
+    'alnum': str.isalnum,
+    'upper': str.isupper,
+    'lower': str.islower,
+    'word': is_word,
+    'any': is_any,
+}
+
+# resource 不短于此长度时预先计算整段的成员标记
+MASK_MIN = 1024
+# 可以列举的字符数的上限, 见 finite
+FINITE_MAX = 256
+
+
+class Table(dict):
+    '''
+    {..., 码位: 1 或 0}, 缺少的码位在首次查询时计算
+    '''
+
+    def __init__(self, cls: 'CharClass'):
+        super().__init__()
+        self.cls = cls
+
+    def __missing__(self, key: int):
+        val = self[key] = int(self.cls.test(chr(key)))
+        return val
+
+
+class CharClass:
+    '''
+    chars 中的字符, ranges 中的区间 (首, 尾), 属于 classes 中任一预定义类的字符, 或属于 members 中任一 CharClass 的字符
+    negate 为真时取反
+    与函数目标一样逐个判断 char, 但只由数据组成, 可以 pickle, 比较, 求并集和取反
+    '''
+
+    def __init__(self, chars: str = '', classes=(), negate: bool = False, ranges=(), members=()):
+        for name in classes:
+            if name not in CLASSES:
+                raise KeyError(name)
+        self.chars = frozenset(chars)
+        self.classes = tuple(classes)
+        self.negate = negate
+        self.ranges = tuple((lo, hi) for lo, hi in ranges)
+        self.members = tuple(members)
+        self.preds = tuple(CLASSES[name] for name in self.classes)
+        self.table = Table(self)
+
+    def test(self, char: str):
+        '''
+        不经查找表直接判断
+        '''
+        hit = (char in self.chars
+               or any(lo <= char <= hi for lo, hi in self.ranges)
+               or any(pred(char) for pred in self.preds)
+               or any(member(char) for member in self.members))
+        return hit is not self.negate
+
+    def __call__(self, char: str):
+        return self.table[ord(char)] == 1
+
+    def mask(self, resource: str, masks: dict):
+        '''
+        resource 中每个字符的成员标记, 返回 (标记, 表示非成员的值), 标记支持 find
+        结果存入 masks, 即 Context.masks, 随 Context 一同释放
+        '''
+        masked = masks.get(self)
+        if masked is not None and masked[0] is resource:
+            return masked[1:]
+        if numpy is not None:
+            points = numpy.frombuffer(resource.encode('utf-32-le', 'surrogatepass'), dtype=numpy.uint32)
+            unique, inverse = numpy.unique(points, return_inverse=True)
+            lut = numpy.array([self.table[int(i)] for i in unique], dtype=numpy.uint8)
+            mask, zero = lut[inverse].tobytes(), b'\0'
+        else:
+            mask, zero = resource.translate(self.table), '\0'
+        masks[self] = (resource, mask, zero)
+        return mask, zero
+
+    def scan(self, resource: str, pos: int, end: int, masks: dict = None):
+        '''
+        [pos, end) 内第一个非成员的位置, 全部是成员时为 end
+        没有 masks 时逐个查表
+        '''
+        if masks is not None and len(resource) >= MASK_MIN:
+            mask, zero = self.mask(resource, masks)
+            found = mask.find(zero, pos, end)
+            return end if found < 0 else found
+        table = self.table
+        while pos < end and table[ord(resource[pos])]:
+            pos += 1
+        return pos
+
+    def find(self, resource: str, pos: int, masks: dict = None):
+        '''
+        pos 及其之后第一个成员的位置, 没有时为 -1
+        '''
+        if masks is not None and len(resource) >= MASK_MIN:
+            mask, zero = self.mask(resource, masks)
+            return mask.find('\1' if isinstance(zero, str) else b'\1', pos)
+        table = self.table
+        for pos in range(pos, len(resource)):
+            if table[ord(resource[pos])]:
+                return pos
+        return -1
+
+    def finite(self):
+        '''
+        可以列举时返回所有成员字符的 frozenset, 否则返回 None
+        '''
+        if self.negate or self.classes:
+            return None
+        out = set(self.chars)
+        for lo, hi in self.ranges:
+            if ord(hi) - ord(lo) >= FINITE_MAX:
+                return None
+            out.update(map(chr, range(ord(lo), ord(hi) + 1)))
+        for member in self.members:
+            chars = member.finite()
+            if chars is None:
+                return None
+            out |= chars
+        return frozenset(out) if len(out) <= FINITE_MAX else None
+
+    def __invert__(self):
+        return CharClass(self.chars, self.classes, not self.negate, self.ranges, self.members)
+
+    def __or__(self, other: 'CharClass'):
+        if not self.negate and not other.negate:
+            return CharClass(self.chars | other.chars, self.classes + other.classes, False,
+                             self.ranges + other.ranges, self.members + other.members)
+        return CharClass(members=(self, other))
+
+    def __eq__(self, other):
+        return isinstance(other, CharClass) and self.spec == other.spec
+
+    def __hash__(self):
+        return hash(self.spec)
+
+    def __reduce__(self):
+        return CharClass, (''.join(sorted(self.chars)), self.classes, self.negate, self.ranges, self.members)
+
+    @property
+    def spec(self):
+        return self.chars, self.classes, self.negate, self.ranges, self.members
+
+    @property
+    def __name__(self):
+        # 供 R.__repr__ 显示
+        items = (''.join(sorted(self.chars))
+                 + ''.join('{}-{}'.format(lo, hi) for lo, hi in self.ranges)
+                 + ''.join(':{}:'.format(name) for name in self.classes)
+                 + ''.join(member.__name__ for member in self.members))
+        return '[{}{}]'.format('^' if self.negate else '', items)
+
+    def __repr__(self):
+        return 'CharClass({})'.format(self.__name__)
@@ -0,0 +1,390 @@
+'''
+把 R 树生成为专用的 Python 源码, exec 后代替 imatch 匹配
+
+每个节点生成一个生成器函数 match_k(s, op, p, end, sp), 按 imatch 的顺序 yield 成功的结果 (结束位置, 捕获组链表),
+Fail 在 @ 和 match 中被过滤, 因此不再生成
+字符串, 数量条件和捕获组名作为常量写入源码, next_r 链上没有逻辑关系的节点展开为嵌套的循环,
+叶节点直接调用状态机, 只有用到的逻辑关系才会生成对应的代码
+Fail 可见的 ^ 以及作用于非叶节点的 ~ 仍由 imatch 匹配; 生成的函数不使用缓存
+'''
+from math import inf
+
+from .Result import Result, Success, Span
+from .analysis import first_set, seeker
+from .cache import Context
+from .util import explain_n
+
+if False:
+    # 仅用于类型检查
+    from .R import R
+
+# 首字符集合不超过此大小时, 在函数开头判断首字符
+GUARD_MAX = 64
+
+
+def repeat(sub, s: str, op: int, p: int, end: int, sp: Span, from_num: int, to_num, lazy: bool, name: str, unit: int):
+    '''
+    非叶节点的数量条件, 与 imatch 中的 DFS 相同, 只处理成功的结果
+    '''
+    if to_num == 0:
+        yield p, sp
+        return
+    if lazy and from_num == 0:
+        yield p, sp
+
+    # 与 imatch 的 capture_add 相同, 捕获的起点随每个成功的结果前进
+    prev_ed = p
+
+    def capture_add(e: int, s1: Span):
+        nonlocal prev_ed
+        if name:
+            s1 = Span(s1, name, prev_ed, e)
+            prev_ed = e
+        return e, s1
+
+    def step(curr_iter, need: int):
+        for e, s1 in curr_iter:
+            if end - e >= need:
+                yield from sub(s, op, e, end, s1)
+
+    counter = 1
+    curr_iter = sub(s, op, p, end, sp)
+    while counter < from_num:
+        counter += 1
+        curr_iter = step(curr_iter, (from_num - counter) * unit)
+
+    q = [(curr_iter, counter)]
+    while q:
+        last = q[-1]
+        curr_iter, nth = last[:2]
+        try:
+            echo = capture_add(*next(curr_iter))
+        except StopIteration:
+            q.pop()
+            if len(last) == 3:
+                yield last[-1]
+            continue
+        if lazy:
+            yield echo
+            if nth < to_num:
+                q.append((sub(s, op, echo[0], end, echo[1]), nth + 1))
+        elif nth < to_num:
+            q.append((sub(s, op, echo[0], end, echo[1]), nth + 1, echo))
+        else:
+            yield echo
+
+    if not lazy and from_num == 0:
+        yield p, sp
+
+
+def bridge(node: 'R', s: str, op: int, p: int, end: int, sp: Span):
+    '''
+    由 imatch 匹配的节点
+    '''
+    for echo in node.imatch(s, Result(op, p, sp), Context(), end):
+        if echo:
+            yield echo.ed, echo.spans
+
+
+class Generator:
+    '''
+    生成源码, consts 为源码引用的非字面量常量
+    '''
+
+    def __init__(self):
+        self.consts = {'inf': inf, 'Span': Span, 'Result': Result, 'explain_n': explain_n,
+                       'repeat': repeat, 'bridge': bridge}
+        # {..., (id(node), kind): 函数名}
+        self.names = {}
+        self.queue = []
+        self.functions = []
+        self.counter = 0
+
+    def const(self, value, prefix: str):
+        name = '{}{}'.format(prefix, len(self.consts))
+        self.consts[name] = value
+        return name
+
+    def var(self, prefix: str):
+        self.counter += 1
+        return '{}{}'.format(prefix, self.counter)
+
+    def fn(self, node: 'R', kind: str = 'n'):
+        '''
+        node 的函数名, kind 为 'n' 时包括 next_r, 为 'l' 时不包括
+        '''
+        k = (id(node), kind)
+        if k not in self.names:
+            self.names[k] = '{}_{}'.format('match' if kind == 'n' else 'logic', len(self.names))
+            self.queue.append((node, kind))
+        return self.names[k]
+
+    def run(self, root: 'R'):
+        entry = self.fn(root)
+        while self.queue:
+            self.functions.append(self.function(*self.queue.pop()))
+        return entry, '\n\n'.join(self.functions) + '\n'
+
+    # --- 节点 ---
+    @staticmethod
+    def bridged(node: 'R'):
+        return bool(node.xor_r or node.program is not None or (node.invert and node.gen is None))
+
+    @staticmethod
+    def inline(node: 'R'):
+        return not (node.and_r or node.or_r or node.invert or node.xor_r) and node.program is None
+
+    def function(self, node: 'R', kind: str):
+        name = self.names[(id(node), kind)]
+        lines = ['def {}(s, op, p, end, sp):'.format(name)]
+        if kind == 'n' and self.bridged(node):
+            lines.append('    yield from bridge({}, s, op, p, end, sp)'.format(self.const(node, 'R')))
+            return '\n'.join(lines)
+
+        chars, nullable = first_set(node) if kind == 'n' else (None, True)
+        if not nullable and chars is not None and len(chars) <= GUARD_MAX:
+            # 不可能以 s[p] 开头时没有成功的结果
+            if len(chars) == 1:
+                test = 's[p] != {}'.format(repr(next(iter(chars))))
+            else:
+                test = 's[p] not in {}'.format(self.const(frozenset(chars), 'F'))
+            lines.append('    if p >= end or {}:'.format(test))
+            lines.append('        return')
+
+        cont = self.chain(node.next_r) if kind == 'n' else self.terminal
+        lines += self.logic(node, 1, 'p', 'sp', cont)
+        return '\n'.join(lines)
+
+    def terminal(self, ind: int, e: str, sp: str):
+        return ['{}yield {}, {}'.format('    ' * ind, e, sp)]
+
+    def loop(self, ind: int, call: str, cont):
+        '''
+        对 call 的每个结果执行 cont, cont 只是转交结果时用 yield from
+        '''
+        pad = '    ' * ind
+        if cont == self.terminal:
+            return ['{}yield from {}'.format(pad, call)]
+        e1, s1 = self.var('e'), self.var('s')
+        return ['{}for {}, {} in {}:'.format(pad, e1, s1, call)] + cont(ind + 1, e1, s1)
+
+    @staticmethod
+    def src(value):
+        '''
+        数量条件的源码, 常量直接写入
+        '''
+        if value == inf:
+            return 'inf'
+        return value if isinstance(value, str) else repr(value)
+
+    def chain(self, node: 'R'):
+        '''
+        返回处理 next_r 链的 cont(缩进, 结束位置, 捕获组) -> 源码行
+        '''
+        if node is None:
+            return self.terminal
+        if not self.inline(node) or self.bridged(node):
+            def cont(ind: int, e: str, sp: str):
+                return self.loop(ind, '{}(s, op, {}, end, {})'.format(self.fn(node), e, sp), self.terminal)
+            return cont
+
+        rest = self.chain(node.next_r)
+
+        def cont(ind: int, e: str, sp: str):
+            return self.quant(node, ind, e, sp, rest)
+        return cont
+
+    def logic(self, node: 'R', ind: int, p: str, sp: str, cont):
+        if node.and_r:
+            and_fn = self.fn(node.and_r)
+
+            def checked(ind: int, e: str, s1: str):
+                # 在 [p, e) 的窗口内原地匹配, 捕获组不保留
+                return (['{}if any(x == {} for x, _ in {}(s, {}, {}, {}, None)):'.format(
+                    '    ' * ind, e, and_fn, p, p, e)] + cont(ind + 1, e, s1))
+            return self.quant(node, ind, p, sp, checked)
+
+        if node.or_r:
+            if cont != self.terminal:
+                # 分支之后的 next_r 链只生成一次
+                return self.loop(ind, '{}(s, op, {}, end, {})'.format(self.fn(node, 'l'), p, sp), cont)
+            return (self.quant(node, ind, p, sp, cont)
+                    + self.loop(ind, '{}(s, op, {}, end, {})'.format(self.fn(node.or_r), p, sp), cont))
+
+        if node.invert:
+            return self.inverted_leaf(node, ind, p, sp, cont)
+        return self.quant(node, ind, p, sp, cont)
+
+    # --- 数量条件 ---
+    def capture_name(self, node: 'R'):
+        if not node.name:
+            return None
+        return repr(node.name) if isinstance(node.name, str) else self.const(node.name, 'K')
+
+    def nums(self, node: 'R', ind: int, p: str, sp: str):
+        '''
+        返回 (源码行, from_num, to_num), 常量时 from_num 和 to_num 为数值, 否则为变量名
+        '''
+        from_num, to_num = node.num_t
+        if isinstance(from_num, int) and (isinstance(to_num, int) or to_num == inf):
+            return [], from_num, to_num
+        fr, to = self.var('fr'), self.var('to')
+        line = '{}{}, {} = explain_n(Result(op, {}, {}), {})'.format(
+            '    ' * ind, fr, to, p, sp, self.const(node.num_t, 'N'))
+        return [line], fr, to
+
+    def quant(self, node: 'R', ind: int, p: str, sp: str, cont):
+        pad = '    ' * ind
+        name = self.capture_name(node)
+        if node.gen is None:
+            target_fn = self.fn(node.target)
+            if node.num_t == (1, 1) and name is None:
+                return self.loop(ind, '{}(s, op, {}, end, {})'.format(target_fn, p, sp), cont)
+            lines, fr, to = self.nums(node, ind, p, sp)
+            lazy = node.mode.value == 'L'
+            return lines + self.loop(ind, 'repeat({}, s, op, {}, end, {}, {}, {}, {}, {}, {})'.format(
+                target_fn, p, sp, self.src(fr), self.src(to), lazy, name, node.target.bounds[0]), cont)
+
+        target = node.target
+        if isinstance(target, str) and node.num_t == (1, 1):
+            # 单个字符串直接比对
+            e1 = self.var('e')
+            lines = ['{}if s.startswith({}, {}, end):'.format(pad, repr(target), p),
+                     '{}    {} = {} + {}'.format(pad, e1, p, len(target))]
+            if name:
+                s1 = self.var('s')
+                lines.append('{}    {} = Span({}, {}, {}, {})'.format(pad, s1, sp, name, p, e1))
+                return lines + cont(ind + 1, e1, s1)
+            return lines + cont(ind + 1, e1, sp)
+
+        gen = self.const(node.gen, 'G')
+        width = node.gen.width
+        lines, fr, to = self.nums(node, ind, p, sp)
+        n, c, e1, s1 = self.var('n'), self.var('c'), self.var('e'), self.var('s')
+        if node.mode.value == 'L':
+            if isinstance(fr, str):
+                lines += ['{}if {} == 0:'.format(pad, fr)] + cont(ind + 1, p, sp)
+            elif fr == 0:
+                lines += cont(ind, p, sp)
+            lines += ['{}{}, {}, {} = 0, {}, {}'.format(pad, c, e1, s1, p, sp),
+                      '{}while {}:'.format(pad, 'True' if to == inf else '{} < {}'.format(c, self.src(to))),
+                      '{}    {}, _ = {}(s, {}, end, 1, op)'.format(pad, n, gen, e1),
+                      '{}    if not {}:'.format(pad, n),
+                      '{}        break'.format(pad),
+                      '{}    {} += 1'.format(pad, c),
+                      '{}    {} += {}'.format(pad, e1, width)]
+            if name:
+                lines.append('{}    {} = Span({}, {}, {} - {}, {})'.format(pad, s1, s1, name, e1, width, e1))
+            if isinstance(fr, int) and fr <= 1:
+                return lines + cont(ind + 1, e1, s1)
+            lines.append('{}    if {} <= {}:'.format(pad, self.src(fr), c))
+            return lines + cont(ind + 2, e1, s1)
+
+        # 贪婪模式先求出最长的重复次数, 再依次给出更少的次数
+        lines.append(self.greedy(ind, n, '_', gen, p, to))
+        if name:
+            spans = self.var('sps')
+            lines += ['{}{} = [{}]'.format(pad, spans, sp),
+                      '{}for {} in range({}):'.format(pad, c, n),
+                      '{}    {}.append(Span({}[-1], {}, {} + {} * {}, {} + ({} + 1) * {}))'.format(
+                          pad, spans, spans, name, p, c, width, p, c, width)]
+        stop = fr - 1 if isinstance(fr, int) else '{} - 1'.format(fr)
+        lines.append('{}for {} in range({}, {}, -1):'.format(pad, c, n, stop))
+        if name:
+            lines.append('{}    {} = {}[{}]'.format(pad, s1, spans, c))
+        else:
+            s1 = sp
+        lines.append('{}    {} = {} + {} * {}'.format(pad, e1, p, c, width) if width != 1
+                     else '{}    {} = {} + {}'.format(pad, e1, p, c))
+        return lines + cont(ind + 1, e1, s1)
+
+    def greedy(self, ind: int, n: str, f: str, gen: str, p: str, to):
+        '''
+        贪婪模式一次求出最多 to 次的重复次数和失败的位置
+        '''
+        call = '{}(s, {}, end, {}, op)'.format(gen, p, self.src(to))
+        if isinstance(to, str):
+            call += ' if {} else (0, None)'.format(to)
+        elif to == 0:
+            call = '0, None'
+        return '{}{}, {} = {}'.format('    ' * ind, n, f, call)
+
+    def inverted_leaf(self, node: 'R', ind: int, p: str, sp: str, cont):
+        '''
+        ~ 叶节点: 只有叶节点的 Fail 取反后成为成功的结果
+        '''
+        pad = '    ' * ind
+        name = self.capture_name(node)
+        gen = self.const(node.gen, 'G')
+        width = node.gen.width
+        lines, fr, to = self.nums(node, ind, p, sp)
+        n, f, c, e1, s1 = self.var('n'), self.var('f'), self.var('c'), self.var('e'), self.var('s')
+        if node.mode.value == 'L':
+            lines += ['{}{}, {}, {} = 0, {}, {}'.format(pad, c, e1, s1, p, sp),
+                      '{}while {}:'.format(pad, 'True' if to == inf else '{} < {}'.format(c, self.src(to))),
+                      '{}    {}, {} = {}(s, {}, end, 1, op)'.format(pad, n, f, gen, e1),
+                      '{}    if {} is not None:'.format(pad, f)]
+            lines += cont(ind + 2, f, s1)
+            lines += ['{}        break'.format(pad),
+                      '{}    if not {}:'.format(pad, n),
+                      '{}        break'.format(pad),
+                      '{}    {} += 1'.format(pad, c),
+                      '{}    {} += {}'.format(pad, e1, width)]
+            if name:
+                lines.append('{}    {} = Span({}, {}, {} - {}, {})'.format(pad, s1, s1, name, e1, width, e1))
+            return lines
+
+        lines.append(self.greedy(ind, n, f, gen, p, to))
+        lines.append('{}if {} is not None:'.format(pad, f))
+        if name:
+            lines += ['{}    {} = {}'.format(pad, s1, sp),
+                      '{}    for {} in range({}):'.format(pad, c, n),
+                      '{}        {} = Span({}, {}, {} + {} * {}, {} + ({} + 1) * {})'.format(
+                          pad, s1, s1, name, p, c, width, p, c, width)]
+        else:
+            s1 = sp
+        return lines + cont(ind + 1, f, s1)
+
+
+class Generated:
+    '''
+    R.codegen 的结果, source 为生成的源码
+    '''
+
+    def __init__(self, pattern: 'R'):
+        self.pattern = pattern
+        generator = Generator()
+        self.entry, self.source = generator.run(pattern)
+        namespace = dict(generator.consts)
+        exec(compile(self.source, '<R.codegen>', 'exec'), namespace)
+        self.run = namespace[self.entry]
+        self.seek = seeker(pattern)
+
+    def imatch(self, resource: str, pos: int = 0, end: int = None):
+        '''
+        按 imatch 的顺序 yield 在 pos 开始的成功的结果
+        '''
+        for ed, spans in self.run(resource, pos, pos, len(resource) if end is None else end, None):
+            yield Success(pos, ed, spans)
+
+    def finditer(self, resource: str):
+        '''
+        与 R.finditer 相同
+        '''
+        seek = self.seek
+        limit = len(resource) - max(self.pattern.bounds[0], 1) + 1
+        cursor = 0
+        while cursor < limit:
+            if seek:
+                cursor = seek(resource, cursor)
+                if cursor < 0:
+                    break
+            nxt = cursor + 1
+            for echo in self.imatch(resource, cursor):
+                yield echo
+                nxt = max(echo.ed, nxt)
+                break
+            cursor = nxt
+
+    def match(self, resource: str):
+        return list(self.finditer(resource))
@@ -0,0 +1,238 @@
+'''
+改写和编译结果的磁盘缓存, 短生命周期的进程不必每次重新分析同样的模式
+
+键是 R 树的结构指纹: 目标, 数量条件, 捕获组名, 模式, 逻辑关系的连接, 函数的模块, 限定名和字节码
+值是改写或编译后的树经 to_portable 得到的数据, 整个缓存保存在一个带版本号和校验和的 pickle 文件中
+含 lambda 或局部函数的模式无法序列化, 照常在进程内改写, 不写入缓存
+'''
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import weakref
+from types import CodeType
+
+from .R import R, RecursionWrapper
+from .charclass import CharClass
+from .portable import VERSION as PORTABLE_VERSION
+
+# 改写或序列化的格式变化时递增, 旧文件整体失效
+VERSION = 2
+
+
+def stable_repr(value):
+    '''
+    与进程无关的 repr, frozenset 的顺序受字符串哈希的随机化影响, 需要排序
+    '''
+    if isinstance(value, (frozenset, set)):
+        return '{' + ', '.join(sorted(stable_repr(i) for i in value)) + '}'
+    if isinstance(value, tuple):
+        return '(' + ', '.join(stable_repr(i) for i in value) + ')'
+    return repr(value)
+
+
+def code_digest(code: CodeType, h):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            code_digest(const, h)
+        else:
+            h.update(stable_repr(const).encode())
+
+
+def func_identity(func):
+    '''
+    函数目标和函数数量条件的标识, 函数体修改后标识随之改变
+    '''
+    if isinstance(func, CharClass):
+        return ('cc', ''.join(sorted(func.chars)), func.classes, func.negate, func.ranges,
+                tuple(func_identity(member) for member in func.members))
+    qualname = getattr(func, '__qualname__', None)
+    if qualname is None:
+        raise TypeError('{!r} 没有稳定的标识'.format(func))
+    code = getattr(func, '__code__', None)
+    if code is None:
+        # 内置函数和方法, 如 str.isdigit
+        return ('builtin', getattr(func, '__module__', None), qualname)
+    h = hashlib.sha256()
+    code_digest(code, h)
+    return ('func', func.__module__, qualname, h.hexdigest())
+
+
+def fingerprint(root: R):
+    '''
+    R 树的结构指纹, 节点按遍历顺序编号, 共享的节点和 RecursionWrapper 的环按编号引用
+    '''
+    index = {}
+    nodes = []
+    wrappers = {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node is None or id(node) in index:
+            continue
+        index[id(node)] = len(nodes)
+        nodes.append(node)
+        target = node._target
+        if isinstance(target, RecursionWrapper):
+            if id(target) not in wrappers:
+                wrappers[id(target)] = (len(wrappers), target)
+                stack.append(target.val)
+        elif isinstance(target, R):
+            stack.append(target)
+        stack.extend((node.and_r, node.or_r, node.xor_r, node.next_r))
+
+    def ref(node):
+        return index[id(node)] if node is not None else None
+
+    out = []
+    for node in nodes:
+        target = node._target
+        if isinstance(target, RecursionWrapper):
+            target = ('rw', wrappers[id(target)][0])
+        elif isinstance(target, R):
+            target = ('r', ref(target))
+        elif isinstance(target, str):
+            target = ('str', target)
+        else:
+            target = func_identity(target)
+        num_t = tuple(func_identity(i) if callable(i) else stable_repr(i) for i in node.num_t)
+        out.append((target, num_t, stable_repr(node.name), node.mode.value, ref(node.and_r), ref(node.or_r),
+                    node.invert, ref(node.xor_r), ref(node.next_r), node.program is not None))
+    rws = tuple(ref(rw.val) for _, rw in sorted(wrappers.values(), key=lambda i: i[0]))
+    return hashlib.sha256(repr((tuple(out), rws)).encode()).hexdigest()
+
+
+class PatternCache:
+    '''
+    磁盘缓存, 文件在首次查找时读取, save 时写回
+
+    cache = PatternCache(path)
+    cache.attach(m1, m2)  # m1, m2 首次 match 或 compile 时先查找缓存
+    ...
+    cache.save()          # 有新条目时写回, 通常在部署时预热后执行一次
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        # {..., (指纹, 'optimize' 或 'compile'): to_portable 的数据}, None 表示尚未读取
+        self.entries = None
+        self.dirty = False
+        # {..., pattern: 指纹}, 同一个 pattern 的改写和编译只计算一次指纹, 不延长 pattern 的生命周期
+        self.prints = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def header():
+        return VERSION, PORTABLE_VERSION, sys.version_info[:2]
+
+    def load(self):
+        '''
+        读取文件, 不存在, 损坏或版本不同时视为空
+        '''
+        if self.entries is not None:
+            return self.entries
+        self.entries = {}
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+            # 条目单独序列化并附上校验和, 内容被改动但仍能读取的文件同样视为损坏
+            if (isinstance(data, dict) and data.get('version') == self.header()
+                    and hashlib.sha256(data['entries']).hexdigest() == data['digest']):
+                entries = pickle.loads(data['entries'])
+                if isinstance(entries, dict):
+                    self.entries = entries
+        except Exception:
+            # 截断或损坏的文件可能引发各种异常, 一律视为空
+            pass
+        return self.entries
+
+    def save(self):
+        '''
+        有新条目时写入临时文件后替换, 读取中的其他进程不会看到写了一半的文件
+        '''
+        if not self.dirty:
+            return
+        folder = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix='.R-cache-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                entries = pickle.dumps(self.entries, pickle.HIGHEST_PROTOCOL)
+                pickle.dump({'version': self.header(), 'digest': hashlib.sha256(entries).hexdigest(),
+                             'entries': entries}, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.dirty = False
+
+    def attach(self, *patterns: R):
+        for pattern in patterns:
+            pattern.store = self
+
+    def lookup(self, pattern: R, kind: str, build):
+        '''
+        返回缓存中 pattern 的 kind 结果, 没有时调用 build() 并存入缓存
+        '''
+        from .optimize import attach_dispatch, intern_trees
+        if pattern not in self.prints:
+            try:
+                self.prints[pattern] = fingerprint(pattern)
+            except TypeError:
+                self.prints[pattern] = None
+        print_ = self.prints[pattern]
+        if print_ is None:
+            return build()
+        k = (print_, kind)
+        entries = self.load()
+        data = entries.get(k)
+        if data is not None:
+            try:
+                this = R.from_portable(data)
+            except Exception:
+                # 损坏的条目视为未命中, 下面重新计算并覆盖
+                this = None
+            if this is not None:
+                self.hits += 1
+                this = intern_trees([this])[0]
+                attach_dispatch([this])
+                this.optimized = this
+                return this
+
+        self.misses += 1
+        this = build()
+        try:
+            entries[k] = this.to_portable()
+            self.dirty = True
+        except TypeError:
+            # lambda 或局部函数
+            pass
+        return this
+
+    def optimize(self, pattern: R):
+        from .optimize import optimize_tree
+        return self.lookup(pattern, 'optimize', lambda: optimize_tree(pattern))
+
+    def compile(self, pattern: R):
+        from .nfa import compile_tree
+        from .optimize import attach_dispatch, intern_trees
+
+        def build():
+            this = intern_trees([compile_tree(pattern.optimize())])[0]
+            attach_dispatch([this])
+            this.optimized = this
+            return this
+        return self.lookup(pattern, 'compile', build)
+
+    def warm(self, patterns):
+        '''
+        改写并编译 patterns 后写回, 用于部署时预热
+        '''
+        for pattern in patterns:
+            self.attach(pattern)
+            pattern.optimize()
+            pattern.compile()
+        self.save()
@@ -0,0 +1,345 @@
+'''
+把不需要回溯特性的 R 子树编译为 Thompson NFA, 用惰性构建并缓存的 DFA 执行
+
+可编译的子树只由字符串, 函数, @, |, 常数数量条件组成:
+没有捕获组, 没有函数/符号数量条件, 没有 &, ~, ^, 也没有 RecursionWrapper
+'''
+from copy import copy
+from math import inf
+
+from .R import R, Mode, RecursionWrapper
+from .util import BranchStop
+
+# 指令: [CHAR, char, next] [PRED, func, next] [SPLIT, 优先, 次选] [JMP, to] [MATCH]
+CHAR, PRED, SPLIT, JMP, MATCH = range(5)
+
+# 展开 {m,n} 后指令数的上限, 超过则不编译
+MAX_PROGRAM = 4096
+# DFA 状态数的上限, 超过则清空缓存重新构建
+MAX_STATES = 4096
+
+
+class Fallback(Exception):
+    '''
+    函数返回了 BranchStop, DFA 无法确定行为, 需回退到逐节点匹配
+    '''
+
+
+class Emitter:
+    '''
+    按 R 的语义生成指令: 节点 = ((target^num) | or_r) @ next_r
+    分支和数量条件的优先顺序与 imatch 的 yield 顺序一致
+    '''
+
+    def __init__(self):
+        self.prog = []
+
+    def add(self, *ins):
+        self.prog.append(list(ins))
+        if len(self.prog) > MAX_PROGRAM:
+            raise OverflowError
+        return len(self.prog) - 1
+
+    def emit(self, node: R):
+        if node.or_r:
+            split = self.add(SPLIT, None, None)
+            self.quantify(node)
+            jmp = self.add(JMP, None)
+            self.prog[split][1:] = split + 1, len(self.prog)
+            self.emit(node.or_r)
+            self.prog[jmp][1] = len(self.prog)
+        else:
+            self.quantify(node)
+        if node.next_r:
+            self.emit(node.next_r)
+
+    def quantify(self, node: R):
+        from_num, to_num = node.num_t
+        lazy = node.mode is Mode.lazy
+
+        for _ in range(from_num):
+            self.atom(node)
+
+        if to_num == inf:
+            split = self.add(SPLIT, None, None)
+            self.atom(node)
+            self.add(JMP, split)
+            self.patch(split, lazy)
+        else:
+            pending = []
+            for _ in range(to_num - from_num):
+                pending.append(self.add(SPLIT, None, None))
+                self.atom(node)
+            for split in pending:
+                self.patch(split, lazy)
+
+    def patch(self, split: int, lazy: bool):
+        body, end = split + 1, len(self.prog)
+        self.prog[split][1:] = (end, body) if lazy else (body, end)
+
+    def atom(self, node: R):
+        if isinstance(node.target, str):
+            for char in node.target:
+                self.add(CHAR, char, len(self.prog) + 1)
+        elif node.gen:
+            self.add(PRED, node.target, len(self.prog) + 1)
+        else:
+            self.emit(node.target)
+
+
+class DFA:
+    '''
+    惰性构建的 DFA 状态表, 状态是 NFA 中消费字符的指令集合
+    '''
+
+    def __init__(self, nfa: 'NFA'):
+        self.nfa = nfa
+        # {..., frozenset(pc): sid}, sid 为 states 的下标
+        self.sid = {}
+        self.states = []
+        self.accept = []
+        # {..., (sid, char): sid}
+        self.trans = {}
+        self.start = self.intern(nfa.closure((0,)))
+
+    def intern(self, pcs: frozenset):
+        sid = self.sid.get(pcs)
+        if sid is None:
+            prog = self.nfa.prog
+            sid = self.sid[pcs] = len(self.states)
+            self.states.append(tuple(pc for pc in pcs if prog[pc][0] != MATCH))
+            self.accept.append(any(prog[pc][0] == MATCH for pc in pcs))
+        return sid
+
+
+class NFA:
+    '''
+    一个编译后的子树, DFA 的状态和转移在匹配时按需构建
+    多个线程可以同时使用, 状态表满了之后换新表, 正在使用旧表的扫描不受影响
+    '''
+
+    def __init__(self, node: R):
+        emitter = Emitter()
+        emitter.emit(node)
+        emitter.add(MATCH)
+        self.prog = [tuple(ins) for ins in emitter.prog]
+        self.dfa = DFA(self)
+
+    def closure(self, pcs):
+        '''
+        沿 SPLIT, JMP 展开, 只保留消费字符的指令和 MATCH
+        '''
+        out = set()
+        stack = list(pcs)
+        seen = set()
+        while stack:
+            pc = stack.pop()
+            if pc in seen:
+                continue
+            seen.add(pc)
+            ins = self.prog[pc]
+            if ins[0] == SPLIT:
+                stack.extend(ins[1:])
+            elif ins[0] == JMP:
+                stack.append(ins[1])
+            else:
+                out.add(pc)
+        return frozenset(out)
+
+    def step(self, dfa: DFA, sid: int, char: str):
+        '''
+        计算并缓存转移, 返回 (dfa, sid), 状态表满了时 dfa 为新表
+        '''
+        nexts = []
+        for pc in dfa.states[sid]:
+            op, arg, nxt = self.prog[pc]
+            if op == CHAR:
+                if arg == char:
+                    nexts.append(nxt)
+            else:
+                res = arg(char)
+                if isinstance(res, BranchStop):
+                    raise Fallback
+                if res:
+                    nexts.append(nxt)
+        pcs = self.closure(nexts)
+
+        if len(dfa.states) >= MAX_STATES:
+            dfa = self.dfa = DFA(self)
+            return dfa, dfa.intern(pcs)
+        nsid = dfa.trans[(sid, char)] = dfa.intern(pcs)
+        return dfa, nsid
+
+    def scan(self, resource: str, pos: int, end: int):
+        '''
+        DFA 在 [pos, end) 内向前扫描
+        返回 (所有可能的结束位置(升序), 扫描到 end 时是否仍有存活的状态, 停止扫描的位置)
+        '''
+        ends = []
+        dfa = self.dfa
+        sid = dfa.start
+        if dfa.accept[sid]:
+            ends.append(pos)
+        for pos in range(pos, end):
+            if not dfa.states[sid]:
+                return ends, False, pos
+            char = resource[pos]
+            nsid = dfa.trans.get((sid, char))
+            if nsid is None:
+                dfa, nsid = self.step(dfa, sid, char)
+            sid = nsid
+            if dfa.accept[sid]:
+                ends.append(pos + 1)
+        return ends, bool(dfa.states[sid]), end
+
+    def ordered(self, resource: str, pos: int, limit: int):
+        '''
+        按优先级 DFS, 以 (pc, pos) 去重, 依次 yield 不重复的结束位置
+        '''
+        prog = self.prog
+        visited = set()
+        yielded = set()
+        stack = [(0, pos)]
+        while stack:
+            pc, pos = stack.pop()
+            while (pc, pos) not in visited:
+                visited.add((pc, pos))
+                ins = prog[pc]
+                op = ins[0]
+                if op == CHAR:
+                    if pos < limit and resource[pos] == ins[1]:
+                        pc, pos = ins[2], pos + 1
+                        continue
+                elif op == PRED:
+                    if pos < limit and ins[1](resource[pos]):
+                        pc, pos = ins[2], pos + 1
+                        continue
+                elif op == SPLIT:
+                    stack.append((ins[2], pos))
+                    pc = ins[1]
+                    continue
+                elif op == JMP:
+                    pc = ins[1]
+                    continue
+                elif pos not in yielded:
+                    yielded.add(pos)
+                    yield pos
+                break
+
+    def ends(self, resource: str, pos: int, end: int, ctx=None):
+        '''
+        按 imatch 的优先顺序返回不重复的结束位置, 需要回退时返回 None
+        '''
+        try:
+            ends, alive, stop = self.scan(resource, pos, end)
+        except Fallback:
+            return None
+        if ctx is not None:
+            if alive and end == len(resource):
+                ctx.at_end()
+                stop = end + 1
+            if stop > ctx.reach:
+                ctx.reach = stop
+        if len(ends) <= 1:
+            return ends
+        return self.ordered(resource, pos, ends[-1])
+
+
+def eligible(node: R, memo: dict):
+    k = id(node)
+    if k not in memo:
+        memo[k] = False
+        from_num, to_num = node.num_t
+        ok = (
+            node.name is None
+            and isinstance(from_num, int) and (isinstance(to_num, int) or to_num == inf)
+            and not (node.and_r or node.xor_r or node.invert)
+            and not isinstance(node._target, RecursionWrapper)
+            and (node.target != '' if node.gen else eligible(node.target, memo))
+            and (node.or_r is None or eligible(node.or_r, memo))
+            and (node.next_r is None or eligible(node.next_r, memo))
+        )
+        memo[k] = ok
+    return memo[k]
+
+
+def children(node: R, visible: bool):
+    '''
+    yield (子节点, 子节点的 Fail 是否可见)
+    Fail 只在被 ~ 和 ^ 使用时可见, 在 @ 和 match 中被过滤
+    '''
+    logic_visible = visible and node.next_r is None
+    num_visible = logic_visible or bool(node.invert or node.xor_r)
+    if not node.gen and isinstance(node.target, R):
+        yield node.target, num_visible
+    if node.and_r:
+        yield node.and_r, False
+    if node.or_r:
+        yield node.or_r, logic_visible
+    if node.xor_r:
+        yield node.xor_r, True
+    if node.next_r:
+        yield node.next_r, visible
+
+
+def copy_tree(node: R, memo: dict, keep_program: bool = False):
+    '''
+    复制整棵树, 保持共享节点和 RecursionWrapper 的环
+    '''
+    if node is None:
+        return None
+    k = id(node)
+    if k not in memo:
+        this = memo[k] = copy(node)
+        if not keep_program:
+            this.program = None
+        # 分派表引用原树的节点, 见 optimize.dispatch_of
+        this.dispatch = None
+        if isinstance(node._target, RecursionWrapper):
+            rw = node._target
+            if id(rw) not in memo:
+                memo[id(rw)] = RecursionWrapper()
+                memo[id(rw)].val = copy_tree(rw.val, memo, keep_program)
+            this._target = memo[id(rw)]
+        elif isinstance(node._target, R):
+            this._target = copy_tree(node._target, memo, keep_program)
+        for attr in ('and_r', 'or_r', 'xor_r', 'next_r'):
+            setattr(this, attr, copy_tree(getattr(node, attr), memo, keep_program))
+    return memo[k]
+
+
+def compile_tree(root: R):
+    '''
+    返回 root 的副本, 其中 Fail 不可见的可编译最大子树挂载了 NFA
+    '''
+    root = copy_tree(root, {})
+
+    # Fail 可见的节点不能编译, 因为 NFA 只产出 Success
+    visible = set()
+    seen = set()
+    stack = [(root, False)]
+    while stack:
+        node, v = stack.pop()
+        if (id(node), v) in seen:
+            continue
+        seen.add((id(node), v))
+        if v:
+            visible.add(id(node))
+        stack.extend(children(node, v))
+
+    memo = {}
+    done = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if id(node) in done:
+            continue
+        done.add(id(node))
+        if id(node) not in visible and eligible(node, memo):
+            try:
+                node.program = NFA(node)
+                continue
+            except OverflowError:
+                pass
+        stack.extend(child for child, _ in children(node, False))
+    return root
@@ -0,0 +1,405 @@
+'''
+把 R 树改写为等价且节点更少的树, 减少 imatch 的调用层数和缓存条目
+
+任何位置都成立的改写:
+    去掉数量条件为 1 的匿名包装节点, 运算符产生的 R(this) 大多属于此类
+    (a @ b) @ c 改写为 a @ (b @ c), (a | b) | c 改写为 a | (b | c)
+只在 Fail 不可见的位置成立的改写 (判断方法与 nfa.children 相同, 改写只保证 Success 不变):
+    相邻的字符串合并为一个字符串
+    r(r('a'), 5) 这样的嵌套数量条件展开为叶节点
+    相邻的字符串分支提取公共前缀
+改写完成后, 结构相同的节点合并为同一个实例(见 intern_trees), 再为 Fail 不可见的 | 链建立按首字符选择分支的分派表
+'''
+from copy import copy
+from weakref import WeakValueDictionary
+
+from .R import R, RecursionWrapper
+from .analysis import first_set
+from .charclass import CharClass
+from .nfa import children, copy_tree
+from .util import make_gen
+
+# 改写的轮数上限
+MAX_PASSES = 64
+
+# {..., 节点的结构: 规范的节点}, 只保留弱引用, 见 intern_trees
+INTERNED = WeakValueDictionary()
+
+
+def has_logic(node: R):
+    return bool(node.and_r or node.or_r or node.invert or node.xor_r)
+
+
+def plain_wrapper(node: R):
+    '''
+    数量条件为 1, 直接包含另一个 R 的匿名节点
+    '''
+    return node.num_t == (1, 1) and node.name is None and isinstance(node._target, R) and node.program is None
+
+
+def literal(node: R):
+    '''
+    只匹配一次的匿名字符串叶节点, 没有 & ~ ^, 也不是编译过的节点
+    '''
+    return (node.gen is not None and isinstance(node.target, str) and node.num_t == (1, 1) and node.name is None
+            and not (node.and_r or node.invert or node.xor_r) and node.program is None)
+
+
+def become(node: R, other: R):
+    '''
+    原地把 node 替换为 other 的内容, 所有引用 node 的地方随之改变
+    '''
+    state = dict(other.__dict__)
+    node.__dict__.clear()
+    node.__dict__.update(state)
+
+
+def retarget(node: R, target, num_t: tuple, name: str, mode):
+    node._target = target
+    node.num_t = num_t
+    node.name = name
+    node.mode = mode
+    node.gen = make_gen(target) if not isinstance(target, (R, RecursionWrapper)) else None
+
+
+def append_next(node: R, tail: R):
+    '''
+    返回 node @ tail 的等价节点: 复制 node 的 next_r 链, 在末端接上 tail
+    链上有编译过的节点时返回 None
+    '''
+    head = this = copy(node)
+    while True:
+        if this.program is not None:
+            return None
+        if this.next_r is None:
+            this.next_r = tail
+            return head
+        this.next_r = copy(this.next_r)
+        this = this.next_r
+
+
+def join_or(branch: R, tail: R):
+    '''
+    返回 branch | tail 的等价节点, 尽量接在 branch 的 or_r 链末端
+    '''
+    if branch.next_r is None and not (branch.and_r or branch.invert or branch.xor_r) and branch.program is None:
+        this = copy(branch)
+        this.or_r = join_or(branch.or_r, tail) if branch.or_r is not None else tail
+        return this
+    this = R(branch)
+    this.or_r = tail
+    return this
+
+
+def unwrap(node: R):
+    '''
+    任何位置都成立的改写, 返回是否改写
+    '''
+    if node.program is not None or not plain_wrapper(node):
+        return False
+    inner = node._target
+    if not has_logic(node) and node.next_r is None:
+        become(node, inner)
+        return True
+    if inner.program is not None:
+        return False
+    if not has_logic(node):
+        # R(inner) @ next
+        this = append_next(inner, node.next_r)
+        if this is None:
+            return False
+        become(node, this)
+        return True
+    if not has_logic(inner) and inner.next_r is None:
+        # 逻辑关系留在 node 上
+        retarget(node, inner._target, inner.num_t, inner.name, inner.mode)
+        return True
+    if node.or_r and not (node.and_r or node.invert or node.xor_r) and inner.next_r is None and inner.or_r:
+        # R(a | b) | c
+        this = copy(inner)
+        this.or_r = join_or(inner.or_r, node.or_r)
+        this.next_r = node.next_r
+        become(node, this)
+        return True
+    return False
+
+
+def flatten(node: R):
+    '''
+    r(r('a'), 5) -> r('a', 5), 数量条件的 Fail 需不可见
+    '''
+    inner = node._target
+    if (node.gen is None and isinstance(inner, R) and node.name is None and not (node.invert or node.xor_r)
+            and inner.gen is not None and inner.num_t == (1, 1) and inner.name is None
+            and not has_logic(inner) and inner.next_r is None and inner.program is None):
+        retarget(node, inner.target, node.num_t, None, node.mode)
+        return True
+    return False
+
+
+def fuse(node: R):
+    '''
+    r('ab') @ r('c') -> r('abc'), node 的 Fail 需不可见
+    '''
+    tail = node.next_r
+    if literal(node) and not node.or_r and tail is not None and literal(tail) and not tail.or_r:
+        retarget(node, node.target + tail.target, (1, 1), None, node.mode)
+        node.next_r = tail.next_r
+        return True
+    return False
+
+
+def factor(node: R):
+    '''
+    r('ab') | r('ac') | c -> R(r('a') @ (r('b') | r('c'))) | c, 分支的 Fail 需不可见
+    '''
+    run = [node]
+    while run[-1].or_r is not None:
+        nxt = run[-1].or_r
+        if not (literal(nxt) and nxt.next_r is None and nxt.target[0] == node.target[0]):
+            break
+        run.append(nxt)
+    if len(run) < 2:
+        return False
+
+    prefix = node.target
+    for i in run[1:]:
+        n = 0
+        while n < min(len(prefix), len(i.target)) and prefix[n] == i.target[n]:
+            n += 1
+        prefix = prefix[:n]
+    if any(len(i.target) == len(prefix) for i in run):
+        # 剩余部分不能为空串
+        prefix = prefix[:-1]
+        if not prefix:
+            return False
+
+    alts = [R(i.target[len(prefix):], mode=i.mode) for i in run]
+    for this, nxt in zip(alts, alts[1:]):
+        this.or_r = nxt
+    rest = run[-1].or_r
+    if rest is None:
+        retarget(node, prefix, (1, 1), None, node.mode)
+        alts[0].next_r = node.next_r
+        node.or_r = None
+        node.next_r = alts[0]
+    else:
+        head = R(prefix)
+        head.next_r = alts[0]
+        retarget(node, head, (1, 1), None, node.mode)
+        node.or_r = rest
+    return True
+
+
+def nodes_of(roots: list):
+    seen = set()
+    out = []
+    stack = list(roots)
+    while stack:
+        node = stack.pop()
+        if node is None or id(node) in seen:
+            continue
+        seen.add(id(node))
+        out.append(node)
+        stack.extend(child for child, _ in children(node, False))
+    return out
+
+
+def visible_of(roots: list):
+    '''
+    Fail 在某个位置可见的节点, 见 nfa.children
+    '''
+    visible = set()
+    seen = set()
+    stack = [(root, False) for root in roots]
+    while stack:
+        node, v = stack.pop()
+        if (id(node), v) in seen:
+            continue
+        seen.add((id(node), v))
+        if v:
+            visible.add(id(node))
+        stack.extend(children(node, v))
+    return visible
+
+
+def or_branches(node: R):
+    '''
+    把 | 链展开为按优先级排列的分支, 每个分支是去掉 or_r 的副本; 无法拆开的节点整体作为最后一个分支
+    '''
+    out = []
+    this = node
+    while this is not None:
+        if this.program is not None or (this is not node and (has_logic(this) and not this.or_r or this.next_r)):
+            out.append(this)
+            break
+        branch = copy(this)
+        branch.or_r = None
+        branch.next_r = None
+        branch._bounds = None
+        branch.optimized = None
+        branch.dispatch = None
+        out.append(branch)
+        this = this.or_r
+    return out
+
+
+def may_start(branch: R, char: str):
+    '''
+    首字符集合未知的分支能否以 char 开头, 至少匹配一次的 CharClass 叶节点可以直接判断
+    '''
+    from_num = branch.num_t[0]
+    if (branch.gen is not None and isinstance(branch.target, CharClass) and not has_logic(branch)
+            and isinstance(from_num, int) and from_num >= 1):
+        return branch.target(char)
+    return True
+
+
+def dispatch_of(node: R):
+    '''
+    返回 (table, default, branches)
+    table: {..., char: 可能以 char 开头的分支}, default: 首字符集合未知或能匹配空串的分支, 用于 table 之外的字符
+    跳过的分支只可能产生 Fail, 因此只用于 Fail 不可见的节点; 没有可跳过的分支时返回 None
+    '''
+    branches = or_branches(node)
+    if len(branches) < 2:
+        return None
+    firsts = [first_set(branch) for branch in branches]
+    keys = set()
+    for chars, nullable in firsts:
+        if not nullable and chars is not None:
+            keys |= chars
+    default = tuple(b for b, (chars, nullable) in zip(branches, firsts) if nullable or chars is None)
+    if not keys or len(default) == len(branches):
+        return None
+
+    def starts(branch: R, chars, nullable: bool, char: str):
+        # 能匹配空串的分支在任何字符下都要尝试
+        if nullable:
+            return True
+        return may_start(branch, char) if chars is None else char in chars
+
+    table = {char: tuple(b for b, (chars, nullable) in zip(branches, firsts) if starts(b, chars, nullable, char))
+             for char in keys}
+    return table, default, tuple(branches)
+
+
+def attach_dispatch(roots: list):
+    '''
+    为 Fail 不可见的 | 链的首个节点建立分派表; 链中的后续节点已由首个节点的分派表覆盖
+    '''
+    visible = visible_of(roots)
+    nodes = nodes_of(roots)
+    heads = [node for node in nodes if node.or_r is not None and node.program is None and not node.and_r
+             and (id(node) not in visible or node.next_r)]
+    tails = {id(node.or_r) for node in heads}
+    for node in heads:
+        if id(node) not in tails:
+            node.dispatch = dispatch_of(node)
+
+
+def structure(node: R, visible: bool):
+    '''
+    节点的结构, 子节点已经是规范的节点, 按 id 比较
+    分派表只建立在 Fail 不可见的节点上, 可见性不同的节点不能合并
+    '''
+    target = node._target
+    if isinstance(target, (R, RecursionWrapper)):
+        target = (type(target), id(target))
+
+    def ref(child):
+        return id(child) if child is not None else None
+
+    return (target, node.num_t, node.name, node.mode, ref(node.and_r), ref(node.or_r), node.invert,
+            ref(node.xor_r), ref(node.next_r), node.program is not None, visible)
+
+
+def intern_trees(roots: list):
+    '''
+    原地把结构相同的节点(包括之前合并过的其他树中的节点)替换为同一个实例, 返回替换后的 roots
+    缓存的键基于节点的 id, 相同的子模式在相同的位置只匹配一次; 大量模式共用的片段也只保留一份
+    RecursionWrapper 按 id 区分, 递归的子树只在同一个 RecursionWrapper 内合并
+    '''
+    visible = visible_of(roots)
+    # 后序遍历, 子节点先于父节点
+    order = []
+    wrappers = {}
+    seen = set()
+    stack = [(root, False) for root in reversed(roots)]
+    while stack:
+        node, done = stack.pop()
+        if done:
+            order.append(node)
+            continue
+        if node is None or id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.append((node, True))
+        target = node._target
+        if isinstance(target, RecursionWrapper):
+            if id(target) not in wrappers:
+                wrappers[id(target)] = target
+                stack.append((target.val, False))
+        elif isinstance(target, R):
+            stack.append((target, False))
+        stack.extend((child, False) for child in (node.and_r, node.or_r, node.xor_r, node.next_r))
+
+    canon = {}
+    for node in order:
+        # 改写后递归可能不经过 RecursionWrapper 形成环, 环上的回边保持原样
+        if isinstance(node._target, R):
+            node._target = canon.get(id(node._target), node._target)
+        for attr in ('and_r', 'or_r', 'xor_r', 'next_r'):
+            child = getattr(node, attr)
+            if child is not None:
+                setattr(node, attr, canon.get(id(child), child))
+        try:
+            canon[id(node)] = INTERNED.setdefault(structure(node, id(node) in visible), node)
+        except TypeError:
+            # 不可哈希的名字或数量条件
+            canon[id(node)] = node
+    for rw in wrappers.values():
+        if rw.val is not None:
+            rw.val = canon[id(rw.val)]
+    return [canon[id(root)] for root in roots]
+
+
+def optimize_trees(roots: list):
+    '''
+    返回 roots 改写后的副本, 各 root 之间共享的节点仍然共享; 编译过的节点原样保留
+    '''
+    memo = {}
+    roots = [copy_tree(root, memo, keep_program=True) for root in roots]
+    for _ in range(MAX_PASSES):
+        changed = False
+        for node in nodes_of(roots):
+            while unwrap(node):
+                changed = True
+
+        visible = visible_of(roots)
+        for node in nodes_of(roots):
+            if node.program is not None:
+                continue
+            invisible = id(node) not in visible
+            if invisible and (flatten(node) or fuse(node)):
+                changed = True
+            elif literal(node) and node.or_r and (invisible or node.next_r) and factor(node):
+                # node 带有 next_r 时, 各分支的 Fail 总是不可见
+                changed = True
+        if not changed:
+            break
+
+    for node in nodes_of(roots):
+        node._bounds = None
+        node.optimized = None
+        node.generated = None
+        node.store = None
+    roots = intern_trees(roots)
+    attach_dispatch(roots)
+    for root in roots:
+        root.optimized = root
+    return roots
+
+
+def optimize_tree(root: R):
+    return optimize_trees([root])[0]
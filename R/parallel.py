@@ -0,0 +1,150 @@
+'''
+把一个长字符串切成有重叠的块, 在多个进程中匹配后按游标合并, 结果与 match 相同
+
+字符串不经序列化, 由 fork 的子进程以写时复制的方式共享; 一次匹配最多读取 max_len 个字符,
+因此块 [st, ed) 内开始的匹配只读取 [st, ed + max_len) 的内容
+各进程从块的开头起独立推进游标; 合并时, 前一块留下的游标若落在某个进程尝试过的位置,
+之后的结果与该进程的一致, 否则在主进程中逐个位置匹配, 直到与进程的游标重合
+'''
+import multiprocessing
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from math import inf, ceil
+
+from .Result import Result, Success
+from .analysis import seeker
+from .cache import Context
+
+if False:
+    # 仅用于类型检查
+    from .R import R
+
+# 块的最小长度, 太短时进程间通信的开销大于匹配本身
+MIN_CHUNK = 1 << 14
+
+# 进程内的状态, 由 init 在 fork 后设置
+_pattern = None
+_resource = None
+
+
+def init(pattern: 'R', resource: str):
+    global _pattern, _resource
+    _pattern = pattern
+    _resource = resource
+
+
+def attempt(pattern: 'R', resource: str, pos: int, ctx: Context):
+    '''
+    在 pos 开始匹配一次, 返回第一个成功的结果, 没有则为 None
+    '''
+    for echo in pattern.imatch(resource, Result(pos, pos), ctx):
+        if echo:
+            return echo
+    return None
+
+
+def run_chunk(st: int, ed: int):
+    '''
+    从 st 起推进游标, 返回在 [st, ed) 内开始的所有结果 [... (op, ed, capture)]
+    '''
+    seek = seeker(_pattern)
+    ctx = Context()
+    out = []
+    cursor = st
+    while cursor < ed:
+        if seek:
+            cursor = seek(_resource, cursor)
+            if cursor < 0 or cursor >= ed:
+                break
+        ctx.evict(cursor)
+        echo = attempt(_pattern, _resource, cursor, ctx)
+        if echo:
+            out.append((echo.op, echo.ed, echo.capture))
+            cursor = max(echo.ed, cursor + 1)
+        else:
+            cursor += 1
+    return out
+
+
+def match_parallel(pattern: 'R', resource: str, workers: int = None, max_len=None, chunk_size: int = None):
+    '''
+    见 R.match_parallel
+    '''
+    workers = workers or multiprocessing.cpu_count()
+    pattern = pattern.optimize()
+    if max_len is None:
+        max_len = pattern.bounds[1]
+    n = len(resource)
+    if chunk_size is None:
+        chunk_size = max(MIN_CHUNK, ceil(n / (workers * 4)))
+    # 重叠部分不超过块本身
+    chunk_size = max(chunk_size, max_len if max_len != inf else 0, 1)
+    if (max_len == inf or workers < 2 or n <= chunk_size
+            or 'fork' not in multiprocessing.get_all_start_methods()):
+        # 无法确定重叠的长度, 或者不值得并行
+        return pattern.match(resource)
+
+    chunks = [(st, min(st + chunk_size, n)) for st in range(0, n, chunk_size)]
+    # fork 的子进程直接继承 pattern 和 resource, 函数作为匹配目标时也无需序列化
+    with ProcessPoolExecutor(workers, multiprocessing.get_context('fork'), init, (pattern, resource)) as pool:
+        futures = [pool.submit(run_chunk, st, ed) for st, ed in chunks]
+        output_l = []
+        ctx = Context()
+        cursor = 0
+        for (st, ed), future in zip(chunks, futures):
+            found = future.result()
+            ops = [i[0] for i in found]
+            while cursor < ed:
+                # 游标是否落在进程尝试过的位置, 即不在某个结果的内部
+                i = bisect_left(ops, cursor)
+                if i == 0 or max(found[i - 1][1], found[i - 1][0] + 1) <= cursor:
+                    for op, result_ed, capture in found[i:]:
+                        output_l.append(Success(op, result_ed, capture))
+                        cursor = max(result_ed, op + 1)
+                    cursor = max(cursor, ed)
+                    break
+                ctx.evict(cursor)
+                echo = attempt(pattern, resource, cursor, ctx)
+                if echo:
+                    output_l.append(echo)
+                    cursor = max(echo.ed, cursor + 1)
+                else:
+                    cursor += 1
+        return output_l
+
+
+def init_many(pattern: 'R'):
+    global _pattern
+    _pattern = pattern
+
+
+def run_many(documents: list):
+    return [_pattern.match(document) for document in documents]
+
+
+def match_many(pattern: 'R', documents, workers: int = None, batch: int = 64):
+    '''
+    见 R.match_many
+    '''
+    workers = workers or multiprocessing.cpu_count()
+    if workers < 2:
+        for document in documents:
+            yield pattern.match(document)
+        return
+
+    # R 经 to_portable 序列化, 每个进程只接收一次; 同时在途的组数有上限, documents 可以是惰性的
+    with ProcessPoolExecutor(workers, initializer=init_many, initargs=(pattern,)) as pool:
+        pending = deque()
+        group = []
+        for document in documents:
+            group.append(document)
+            if len(group) == batch:
+                pending.append(pool.submit(run_many, group))
+                group = []
+                if len(pending) >= workers * 2:
+                    yield from pending.popleft().result()
+        if group:
+            pending.append(pool.submit(run_many, group))
+        while pending:
+            yield from pending.popleft().result()
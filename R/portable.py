@@ -0,0 +1,100 @@
+'''
+R 树与可序列化的数据互相转换, 用于把 R 交给其他进程
+
+节点和 RecursionWrapper 按下标互相引用, 共享的节点和递归形成的环原样保留
+函数目标和函数数量条件按引用序列化, 需要是模块级的函数; lambda 和局部函数请改用 CharClass
+'''
+from typing import Callable
+
+from .R import R, Mode, RecursionWrapper
+
+VERSION = 1
+
+
+def check_func(func):
+    qualname = getattr(func, '__qualname__', '')
+    if '<lambda>' in qualname or '<locals>' in qualname:
+        raise TypeError('{} 无法序列化, 请使用 CharClass 或模块级的函数'.format(qualname))
+    return func
+
+
+def to_portable(root: R):
+    '''
+    返回只由 tuple, dict, str, int 和模块级函数组成的数据
+    '''
+    index = {}
+    nodes = []
+    wrappers = {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node is None or id(node) in index:
+            continue
+        index[id(node)] = len(nodes)
+        nodes.append(node)
+        target = node._target
+        if isinstance(target, RecursionWrapper):
+            if id(target) not in wrappers:
+                wrappers[id(target)] = (len(wrappers), target)
+                stack.append(target.val)
+        elif isinstance(target, R):
+            stack.append(target)
+        stack.extend((node.and_r, node.or_r, node.xor_r, node.next_r))
+
+    def ref(node):
+        return index[id(node)] if node is not None else None
+
+    out = []
+    for node in nodes:
+        target = node._target
+        if isinstance(target, RecursionWrapper):
+            kind, target = 'rw', wrappers[id(target)][0]
+        elif isinstance(target, R):
+            kind, target = 'r', ref(target)
+        elif isinstance(target, str):
+            kind = 'str'
+        else:
+            kind, target = 'func', check_func(target)
+        num_t = tuple(check_func(i) if isinstance(i, Callable) else i for i in node.num_t)
+        out.append({
+            'kind': kind, 'target': target, 'num': num_t, 'name': node.name, 'mode': node.mode.value,
+            'and': ref(node.and_r), 'or': ref(node.or_r), 'invert': node.invert,
+            'xor': ref(node.xor_r), 'next': ref(node.next_r), 'compiled': node.program is not None,
+        })
+    rws = [ref(rw.val) for _, rw in sorted(wrappers.values(), key=lambda i: i[0])]
+    return {'version': VERSION, 'nodes': tuple(out), 'wrappers': tuple(rws)}
+
+
+def from_portable(data: dict):
+    '''
+    由 to_portable 的数据重建 R, 编译过的子树重新编译
+    '''
+    if data.get('version') != VERSION:
+        raise ValueError('不支持的版本 {}'.format(data.get('version')))
+    nodes = [R.__new__(R) for _ in data['nodes']]
+    wrappers = [RecursionWrapper() for _ in data['wrappers']]
+
+    def deref(i):
+        return nodes[i] if i is not None else None
+
+    for node, d in zip(nodes, data['nodes']):
+        kind, target = d['kind'], d['target']
+        if kind == 'rw':
+            target = wrappers[target]
+        elif kind == 'r':
+            target = nodes[target]
+        R.__init__(node, target, d['num'], d['name'], Mode(d['mode']))
+        node.and_r = deref(d['and'])
+        node.or_r = deref(d['or'])
+        node.invert = d['invert']
+        node.xor_r = deref(d['xor'])
+        node.next_r = deref(d['next'])
+    for rw, i in zip(wrappers, data['wrappers']):
+        rw.val = deref(i)
+
+    compiled = [node for node, d in zip(nodes, data['nodes']) if d['compiled']]
+    if compiled:
+        from .nfa import NFA
+        for node in compiled:
+            node.program = NFA(node)
+    return nodes[0]
@@ -0,0 +1,108 @@
+'''
+按节点统计匹配的开销, 由 Context(profile=Profile()) 开启, 不开启时 imatch 只多一次属性判断
+
+calls: imatch 的调用次数, 等于 hits + misses
+hits / misses: cache_deco 中缓存的命中和未命中次数
+chars: 叶节点的状态机读取的字符数
+backtracks: 数量条件的 DFS 中耗尽一层重复后回退的次数
+time: 推进本节点的结果流的耗时(秒), 包括子节点; 递归的节点会重复计入
+self_time: time 中扣除子节点的部分
+'''
+from time import perf_counter
+
+if False:
+    # 仅用于类型检查
+    from .R import R
+
+# report 中节点文本的最大长度
+LABEL_MAX = 60
+# report 中转义的控制字符, 保持一行一个节点
+ESCAPES = {ord('\t'): '\\t', ord('\n'): '\\n', ord('\r'): '\\r'}
+
+
+class Stats:
+    __slots__ = ('node', 'calls', 'hits', 'misses', 'chars', 'backtracks', 'time', 'self_time')
+
+    def __init__(self, node: 'R'):
+        self.node = node
+        self.calls = 0
+        self.hits = 0
+        self.misses = 0
+        self.chars = 0
+        self.backtracks = 0
+        self.time = 0.0
+        self.self_time = 0.0
+
+    def as_dict(self):
+        return {
+            'node': repr(self.node), 'name': self.node.name,
+            'calls': self.calls, 'hits': self.hits, 'misses': self.misses, 'chars': self.chars,
+            'backtracks': self.backtracks, 'time': self.time, 'self_time': self.self_time,
+        }
+
+
+class Profile:
+    '''
+    {..., id(node): Stats}, 同一个 Profile 可以累计多次匹配
+    '''
+
+    def __init__(self):
+        self.stats = {}
+        # 正在推进的结果流中, 子节点累计的耗时
+        self.stack = []
+
+    def of(self, node: 'R'):
+        stats = self.stats.get(id(node))
+        if stats is None:
+            stats = self.stats[id(node)] = Stats(node)
+        return stats
+
+    def call(self, node: 'R', hit: bool):
+        stats = self.of(node)
+        stats.calls += 1
+        if hit:
+            stats.hits += 1
+        else:
+            stats.misses += 1
+
+    def advance(self, node: 'R', share_iter):
+        '''
+        计时推进 share_iter 一次, StopIteration 照常抛出
+        '''
+        stats = self.of(node)
+        self.stack.append(0.0)
+        st = perf_counter()
+        try:
+            return next(share_iter)
+        finally:
+            spent = perf_counter() - st
+            stats.time += spent
+            stats.self_time += spent - self.stack.pop()
+            if self.stack:
+                self.stack[-1] += spent
+
+    def sorted(self, key: str = 'self_time'):
+        return sorted(self.stats.values(), key=lambda stats: getattr(stats, key), reverse=True)
+
+    def dump(self, key: str = 'self_time'):
+        '''
+        按 key 降序排列的 [... dict], 可以直接 json.dumps
+        '''
+        return [stats.as_dict() for stats in self.sorted(key)]
+
+    def report(self, key: str = 'self_time', limit: int = 20):
+        '''
+        按 key 降序排列的文本表格, 最多 limit 行
+        '''
+        lines = ['{:>10} {:>10} {:>8} {:>8} {:>8} {:>10} {:>10}  {}'.format(
+            'self(ms)', 'time(ms)', 'calls', 'hits', 'misses', 'chars', 'backtracks', 'node')]
+        for stats in self.sorted(key)[:limit]:
+            label = repr(stats.node).translate(ESCAPES)
+            if len(label) > LABEL_MAX:
+                label = label[:LABEL_MAX - 3] + '...'
+            if stats.node.name:
+                label = '{} {}'.format(stats.node.name, label)
+            lines.append('{:>10.3f} {:>10.3f} {:>8} {:>8} {:>8} {:>10} {:>10}  {}'.format(
+                stats.self_time * 1000, stats.time * 1000, stats.calls, stats.hits, stats.misses,
+                stats.chars, stats.backtracks, label))
+        return '\n'.join(lines)
@@ -0,0 +1,156 @@
+'''
+一次扫描同时匹配多个 R
+'''
+import re
+
+from .Result import Result
+from .analysis import first_set, required_prefix, leading_leaf
+from .cache import Context
+from .charclass import CharClass
+from .optimize import optimize_trees
+from .util import MatchLimit
+
+if False:
+    # 仅用于类型检查
+    from .R import R
+
+
+class RSet:
+    '''
+    多个 R 组成的集合, 每个 R 的结果与各自 match 相同, 按位置合并后标上 R 的下标
+
+    各 R 的必需前缀合并成一棵前缀树, 每个位置只沿树走一遍就得到可能在此开始匹配的 R;
+    首字符集合未知的 R 按开头的叶节点分组, 每个位置每个叶节点只判断一次;
+    所有 R 共用一个缓存上下文, 多个 R 中出现的同一个 R 实例共享缓存
+    '''
+
+    def __init__(self, patterns):
+        # 一起改写, 多个 R 中出现的同一个实例在副本中仍然共享
+        self.patterns = optimize_trees(list(patterns))
+        # {..., char: 子树, None: [... 前缀在此结束的下标]}
+        self.trie = {}
+        # {..., char: [... 只知道首字符的下标]}
+        self.by_char = {}
+        # {..., 叶节点的目标: [... 以该叶节点开头的下标]}, 见 leading_leaf
+        self.by_leaf = {}
+        # 能匹配空串或无法分析, 无法排除任何位置的下标
+        self.always = []
+
+        for i, pattern in enumerate(self.patterns):
+            chars, nullable = first_set(pattern)
+            prefix = '' if nullable else required_prefix(pattern)[0]
+            leaf = leading_leaf(pattern) if not nullable and chars is None else None
+            if prefix:
+                node = self.trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, []).append(i)
+            elif leaf is not None:
+                self.by_leaf.setdefault(leaf, []).append(i)
+            elif nullable or chars is None:
+                self.always.append(i)
+            else:
+                for char in chars:
+                    self.by_char.setdefault(char, []).append(i)
+
+        starts = {char for char in self.trie if char is not None} | set(self.by_char)
+        self.search = re.compile('[{}]'.format(''.join(map(re.escape, sorted(starts))))).search if starts else None
+        # 函数目标只能逐个位置判断
+        self.seekable = not self.always and all(isinstance(leaf, CharClass) for leaf in self.by_leaf)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+    def seek(self, resource: str, pos: int, ctx: Context, ahead: dict):
+        '''
+        pos 及其之后第一个可能开始匹配的位置, 没有则为 -1
+        ahead: {..., None 或叶节点的目标: 下一个位置}, 在一次扫描中复用, 每种查找只扫描一遍 resource
+        '''
+        first = -1
+        for key in (None, *self.by_leaf):
+            found = ahead.get(key)
+            if found is None or 0 <= found < pos:
+                if key is None:
+                    found = self.search(resource, pos) if self.search else None
+                    found = found.start() if found else -1
+                else:
+                    found = key.find(resource, pos, ctx.masks)
+                ahead[key] = found
+            if found >= 0 and (first < 0 or found < first):
+                first = found
+        return first
+
+    def candidates(self, resource: str, pos: int):
+        '''
+        可能在 pos 开始匹配的下标(升序)
+        '''
+        char = resource[pos]
+        found = self.always + self.by_char.get(char, [])
+        for leaf, indices in self.by_leaf.items():
+            res = leaf(char)
+            # BranchStop 留给 R 自己在匹配中抛出
+            if res:
+                found.extend(indices)
+        node = self.trie
+        for i in range(pos, len(resource)):
+            node = node.get(resource[i])
+            if node is None:
+                break
+            found.extend(node.get(None, ()))
+        found.sort()
+        return found
+
+    def finditer(self, resource: str, ctx: Context = None, max_steps: int = None, timeout: float = None):
+        '''
+        按位置 yield (下标, 结果), 同一位置按下标顺序
+        每个 R 各有游标, 与单独 match 一样只给出互不重叠的结果
+        max_steps 和 timeout 限制整次扫描, 见 Context.arm
+        '''
+        own = ctx is None
+        ctx = Context() if own else ctx
+        ctx.arm(max_steps, timeout)
+        cursors = [0] * len(self.patterns)
+        min_lens = [pattern.bounds[0] for pattern in self.patterns]
+        pos = 0
+        ahead = {}
+        try:
+            while pos < len(resource):
+                if self.seekable:
+                    pos = self.seek(resource, pos, ctx, ahead)
+                    if pos < 0:
+                        break
+                # 所有 R 之后都只在 pos 及其之后尝试
+                ctx.evict(pos)
+                for i in self.candidates(resource, pos):
+                    if cursors[i] > pos or len(resource) - pos < min_lens[i]:
+                        continue
+                    for echo in self.patterns[i].imatch(resource, Result(pos, pos), ctx):
+                        if echo:
+                            yield i, echo
+                            cursors[i] = max(echo.ed, pos + 1)
+                            break
+                pos += 1
+        except MatchLimit as ml:
+            ml.args = (pos, min(max(ctx.reach, pos), len(resource)))
+            # 中断的 imatch 留下了不完整的缓存
+            ctx.clear()
+            raise
+        finally:
+            if own:
+                ctx.clear()
+
+    def match(self, resource: str, ctx: Context = None, max_steps: int = None, timeout: float = None):
+        '''
+        返回 finditer 的所有结果, 抛出 MatchLimit 时已确定的结果保存在其 results 中
+        '''
+        output_l = []
+        try:
+            for item in self.finditer(resource, ctx, max_steps, timeout):
+                output_l.append(item)
+        except MatchLimit as ml:
+            ml.results = output_l
+            raise
+        return output_l
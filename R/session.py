@@ -0,0 +1,128 @@
+'''
+文本被局部修改后增量地重新匹配
+
+match 的游标逐步前进, 每一步从游标开始向后读取一段文本: 跳到下一个可能开始匹配的位置, 或者在游标处尝试一次
+会话记录每一步的游标, 读取过的最远位置和结果; 复用缓存条目的一步同样依赖条目读取过的内容, 见 cache_deco
+修改 [start, end) 后, 游标和读取范围都在 start 之前的步骤不受影响;
+从第一个受影响的步骤起重新推进游标, 一旦游标回到旧的游标在 end 之后经过的位置, 之后的步骤只读取未修改的文本, 平移后沿用
+缓存条目引用旧的文本, 因此每次重新匹配使用新的缓存上下文
+'''
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+from .Result import Result
+from .analysis import seeker
+from .cache import Context
+
+if False:
+    # 仅用于类型检查
+    from .R import R
+
+
+class MatchSession:
+    '''
+    持有 pattern 在 text 上的匹配结果, edit 之后只重新匹配受影响的区域, results 始终与 pattern.match(text) 相同
+    匹配目标和数量条件中的函数不能依赖结果的绝对位置
+    '''
+
+    def __init__(self, pattern: 'R', text: str):
+        self.pattern = pattern.optimize()
+        self.seek = seeker(self.pattern)
+        self.text = text
+        # 每一步开始时的游标
+        self.cursors = []
+        # 每一步读取过的最远位置(不含), 依赖 text 的长度时为 len(text) + 1
+        self.reaches = []
+        # 每一步的结果, 没有时为 None
+        self.found = []
+        # reaches 的前缀最大值, 用于二分查找第一个受影响的步骤
+        self.prefix_max = []
+        self.cursors, self.reaches, self.found, _ = self.advance(0, lambda cursor: None)
+        self.prefix_max = list(accumulate(self.reaches, max))
+
+    @property
+    def results(self):
+        return [echo for echo in self.found if echo is not None]
+
+    def advance(self, cursor: int, sync):
+        '''
+        从 cursor 起在 self.text 上推进游标, 直到结束或 sync(游标) 返回旧步骤的下标
+        返回新的 (cursors, reaches, found, 同步的旧步骤的下标), 没有同步时下标为 None
+        '''
+        text = self.text
+        pattern = self.pattern
+        seek = self.seek
+        ctx = Context()
+        limit = len(text) - max(pattern.bounds[0], 1) + 1
+        cursors, reaches, found = [], [], []
+
+        def step(reach: int, echo=None):
+            cursors.append(cursor)
+            reaches.append(reach)
+            found.append(echo)
+
+        while True:
+            j = sync(cursor)
+            if j is not None:
+                return cursors, reaches, found, j
+            if cursor >= limit:
+                # 游标停止的位置取决于 text 的长度
+                step(len(text) + 1)
+                return cursors, reaches, found, None
+            # 判断 cursor 能否开始匹配时读取的范围
+            seen = 0
+            if seek:
+                op = seek(text, cursor)
+                if op < 0:
+                    step(len(text) + 1)
+                    return cursors, reaches, found, None
+                if op > cursor:
+                    step(op + seek.width)
+                    cursor = op
+                    continue
+                seen = cursor + seek.width
+
+            ctx.evict(cursor)
+            ctx.reach = 0
+            ctx.hit_end = False
+            echo = None
+            for i in pattern.imatch(text, Result(cursor, cursor), ctx):
+                if i:
+                    echo = i
+                    break
+            reach = len(text) + 1 if ctx.hit_end else ctx.reach
+            step(max(reach, seen), echo)
+            cursor = max(echo.ed, cursor + 1) if echo else cursor + 1
+
+    def edit(self, start: int, end: int, replacement: str):
+        '''
+        把 text[start:end] 替换为 replacement, 并更新 results
+        '''
+        if not 0 <= start <= end <= len(self.text):
+            raise IndexError((start, end))
+        delta = len(replacement) - (end - start)
+        self.text = self.text[:start] + replacement + self.text[end:]
+        cursors, reaches, found = self.cursors, self.reaches, self.found
+
+        # 第一个读到 start 或在 start 之后开始的步骤
+        i = min(bisect_right(self.prefix_max, start), bisect_left(cursors, start))
+        restart = cursors[i]
+        # 旧的游标在 end 之后经过的位置, 按新的坐标
+        lo = bisect_left(cursors, end)
+        new_end = start + len(replacement)
+
+        def sync(cursor: int):
+            if cursor < new_end:
+                return None
+            j = bisect_left(cursors, cursor - delta, lo)
+            return j if j < len(cursors) and cursors[j] == cursor - delta else None
+
+        new_cursors, new_reaches, new_found, j = self.advance(restart, sync)
+        if j is None:
+            j = len(cursors)
+        self.cursors = cursors[:i] + new_cursors + [k + delta for k in cursors[j:]]
+        self.reaches = reaches[:i] + new_reaches + [k + delta for k in reaches[j:]]
+        self.found = found[:i] + new_found + [echo.shift(delta) if echo is not None and delta else echo
+                                              for echo in found[j:]]
+        floor = self.prefix_max[i - 1] if i else 0
+        self.prefix_max[i:] = accumulate((max(floor, k) for k in self.reaches[i:]), max)
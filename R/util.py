@@ -1,6 +1,8 @@
 from math import inf
 from typing import Callable
 
+from .charclass import CharClass
+
 if False:
     # 仅用于类型检查
     from .Result import Result
@@ -60,8 +62,8 @@ def explain_n(result: 'Result', num_t: tuple):
 
     # 符号定义, 则查询捕获组
     if isinstance(from_num, str):
-        from_num = len(result.capture.get(from_num, ()))
-        to_num = len(result.capture.get(to_num, ()))
+        from_num = result.count(from_num)
+        to_num = result.count(to_num)
 
     # 函数定义, 传入捕获组
     elif isinstance(from_num, Callable):
@@ -76,41 +78,76 @@ class BranchStop(Exception):
     pass
 
 
-def make_gen(target):
+class _NeedMore(Exception):
+    '''
+    流式匹配读到缓冲区末尾而输入尚未结束, 结果取决于后续输入, 见 R.match_stream
+    '''
+
+
+class MatchLimit(Exception):
     '''
-    返回一个 generator 来抽象状态机
-    generator 接受一个 Result 来实例化
+    匹配超出 Context 的 max_steps 或 timeout 时抛出
+    args 为 (游标, 读取到的最远位置), results 为此前已经确定的结果
     '''
-    if isinstance(target, str):
-        # 目标是 str, 则不断拿 send 来的 char 来比对目标中的 char
-        def gen(prev_result: 'Result'):
-            curr_result = prev_result.clone()
 
-            for expect_char in target:
-                recv_char = yield 'GO'
-                curr_result.ed += 1
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.results = []
+
 
-                if recv_char != expect_char:
-                    yield curr_result.as_fail()
-            # 全匹配
-            yield curr_result.as_success()
+def make_gen(target):
+    '''
+    返回一个函数来抽象叶节点的状态机
+    gen(resource, pos, end, count, op, ctx) 在 [pos, end) 内最多匹配 count 次, 直接按下标读取 resource
+    返回 (匹配次数, Fail 的结束位置), 因输入耗尽或达到 count 而停止时后者为 None
+    每次匹配的长度固定为 gen.width, ctx 为当前匹配的 Context, 可以省略
+    '''
+    if isinstance(target, str) and target:
+        # 目标是 str, 整段用 startswith 比对
+        width = len(target)
+
+        def gen(resource: str, pos: int, end: int, count, op: int, ctx=None):
+            n = 0
+            while n < count and resource.startswith(target, pos, end):
+                n += 1
+                pos += width
+            if n < count:
+                # 找出第一个不匹配的 char, 输入耗尽则不产生 Fail
+                for i in range(min(width, end - pos)):
+                    if resource[pos + i] != target[i]:
+                        return n, pos + i + 1
+            return n, None
+
+    elif isinstance(target, CharClass):
+        # 目标是字符类, 连续的成员由 scan 一次找出
+        width = 1
+
+        def gen(resource: str, pos: int, end: int, count, op: int, ctx=None):
+            stop = target.scan(resource, pos, end if count == inf else min(end, pos + count),
+                               ctx.masks if ctx is not None else None)
+            n = stop - pos
+            if n < count and stop < end:
+                return n, stop + 1
+            return n, None
 
     elif isinstance(target, Callable):
-        # 目标是函数, 传入 recv_char, 根据真假返回结果
-        def gen(prev_result: 'Result'):
-            curr_result = prev_result.clone()
-            recv_char = yield 'GO'
-            curr_result.ed += 1
-
-            res = target(recv_char)
-            if isinstance(res, BranchStop):
-                res.args = (curr_result.op, curr_result.ed)
-                raise res
-            elif res:
-                yield curr_result.as_success()
-            else:
-                yield curr_result.as_fail()
+        # 目标是函数, 逐个传入 char, 根据真假决定是否继续
+        width = 1
+
+        def gen(resource: str, pos: int, end: int, count, op: int, ctx=None):
+            n = 0
+            while n < count and pos < end:
+                res = target(resource[pos])
+                pos += 1
+                if isinstance(res, BranchStop):
+                    res.args = (op, pos)
+                    raise res
+                elif not res:
+                    return n, pos
+                n += 1
+            return n, None
 
     else:
         raise TypeError
+    gen.width = width
     return gen
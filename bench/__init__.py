@@ -0,0 +1,8 @@
+'''
+R 的性能基准, 在仓库根目录运行 python -m bench
+
+workloads: 工作负载
+measure: 吞吐量, 延迟分位数, 内存峰值和缓存条目数
+'''
+from .measure import measure
+from .workloads import readme, cpp, stress
@@ -0,0 +1,105 @@
+'''
+python -m bench [--suite readme cpp stress] [--max-size 10000000] [--out run.json] [--compare base.json]
+'''
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from time import perf_counter, strftime
+
+from .measure import measure
+from .workloads import readme, cpp, stress
+
+# cpp_gen 的输入长度, 1 KB 到 10 MB
+CPP_SIZES = (1 << 10, 10 << 10, 100 << 10, 1 << 20, 10 << 20)
+
+
+def version():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def workloads(args):
+    if 'readme' in args.suite:
+        yield from readme(args.size)
+    if 'cpp' in args.suite:
+        yield from cpp([size for size in CPP_SIZES if size <= args.max_size])
+    if 'stress' in args.suite:
+        yield from stress()
+
+
+def run(args):
+    out = []
+    # 超出预算后跳过同一套件中更大的输入
+    over = set()
+    for suite, name, pattern, text in workloads(args):
+        if suite in over:
+            print('{:<28} skipped'.format(name), file=sys.stderr)
+            continue
+        st = perf_counter()
+        try:
+            row = measure(pattern, text, args.repeat, not args.no_memory)
+        except RecursionError as e:
+            # 超出递归深度也是一种结果, 记录后继续
+            row = {'chars': len(text), 'error': repr(e)}
+        row.update(suite=suite, name=name)
+        out.append(row)
+        if suite == 'cpp' and perf_counter() - st > args.budget:
+            over.add(suite)
+        if 'error' in row:
+            print('{:<28} {}'.format(name, row['error']), file=sys.stderr)
+        else:
+            print('{:<28} {:>10} chars {:>12.0f} chars/s  p50 {:>9.3f} ms  memo {:>8}'.format(
+                name, row['chars'], row['chars_per_sec'] or 0, row['p50'] * 1000, row['memo_peak']), file=sys.stderr)
+    return {
+        'version': version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': out,
+    }
+
+
+def compare(base: dict, curr: dict):
+    '''
+    按名字对比两次运行的 p50, 比值小于 1 表示变快
+    '''
+    lines = []
+    old = {row['name']: row for row in base['results']}
+    for row in curr['results']:
+        if row.get('p50') and old.get(row['name'], {}).get('p50'):
+            lines.append('{:<28} {:>9.3f} ms -> {:>9.3f} ms  x{:.2f}'.format(
+                row['name'], old[row['name']]['p50'] * 1000, row['p50'] * 1000, row['p50'] / old[row['name']]['p50']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench')
+    parser.add_argument('--suite', nargs='+', default=['readme', 'cpp', 'stress'], choices=['readme', 'cpp', 'stress'])
+    parser.add_argument('--size', type=int, default=64 << 10, help='readme 的输入长度')
+    parser.add_argument('--max-size', type=int, default=10 << 20, help='cpp_gen 的最大输入长度')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=120.0, help='cpp_gen 单个输入的秒数, 超出后不再增大输入')
+    parser.add_argument('--no-memory', action='store_true', help='不运行 tracemalloc')
+    parser.add_argument('--out', help='写入 JSON 的路径, 默认输出到 stdout')
+    parser.add_argument('--compare', help='与之前运行的 JSON 对比')
+    args = parser.parse_args()
+
+    data = run(args)
+    text = json.dumps(data, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), data), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
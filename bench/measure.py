@@ -0,0 +1,79 @@
+'''
+运行一个工作负载并统计吞吐量, 延迟的分位数, 内存峰值和缓存条目数
+
+计时和内存分开运行, tracemalloc 会显著拖慢匹配
+'''
+import tracemalloc
+from time import perf_counter
+
+from R import Context
+
+if False:
+    # 仅用于类型检查
+    from R import R
+
+
+class CountingContext(Context):
+    '''
+    统计缓存条目的峰值和总数
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.stores = 0
+        self.peak = 0
+
+    def store(self, k: tuple, entry: list):
+        super().store(k, entry)
+        self.stores += 1
+        if len(self.memo) > self.peak:
+            self.peak = len(self.memo)
+
+
+def percentile(sorted_l: list, q: float):
+    '''
+    最近秩法
+    '''
+    i = min(len(sorted_l) - 1, max(0, int(round(q * len(sorted_l) + 0.5)) - 1))
+    return sorted_l[i]
+
+
+def measure(pattern: 'R', text: str, repeat: int = 5, memory: bool = True):
+    '''
+    返回 dict: 结果数, 每次 match 的耗时的分位数, 吞吐量(字符/秒), 内存峰值(字节), 缓存条目的峰值和总数
+    '''
+    # 首次匹配包括改写, 不计入耗时
+    ctx = CountingContext()
+    found = len(pattern.match(text, ctx))
+
+    times = []
+    for _ in range(repeat):
+        st = perf_counter()
+        pattern.match(text)
+        times.append(perf_counter() - st)
+    times.sort()
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            pattern.match(text)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    median = percentile(times, 0.5)
+    return {
+        'chars': len(text),
+        'results': found,
+        'repeat': repeat,
+        'p50': median,
+        'p90': percentile(times, 0.9),
+        'p99': percentile(times, 0.99),
+        'min': times[0],
+        'max': times[-1],
+        'chars_per_sec': len(text) / median if median else None,
+        'peak_memory': peak,
+        'memo_peak': ctx.peak,
+        'memo_stores': ctx.stores,
+    }
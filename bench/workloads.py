@@ -0,0 +1,83 @@
+'''
+基准的工作负载: README 中的模式, cpp_gen.py 的语法, 嵌套数量条件和 RecursionWrapper 的压力测试
+
+每个工作负载是 (套件, 名字, R, 文本), 文本由样例重复而成
+'''
+from math import inf
+
+from R import r, Mode, RecursionWrapper
+
+
+def repeat(sample: str, size: int):
+    '''
+    重复 sample 直到长度为 size
+    '''
+    return (sample * (size // len(sample) + 1))[:size]
+
+
+def is_any(char: str):
+    return True
+
+
+def readme(size: int):
+    dot = r(is_any)
+
+    div_head = r('<div', name=':head')
+    div_tail = r('</div>', name=':tail')
+
+    def stop_head_tail_equal(capture: dict):
+        head_group = capture.get(':head', ())
+        tail_group = capture.get(':tail', ())
+        return 1 if not head_group or not tail_group or len(head_group) != len(tail_group) else 0
+
+    sentinel = r('\0', stop_head_tail_equal)
+    div = div_head @ r(div_head | div_tail | ~(div_head | div_tail), '+') @ div_tail @ sentinel
+
+    rw = RecursionWrapper()
+    block = (r('{') @ r(rw, '*') @ r('}')).clone(name=':block')
+    rw.val = block
+
+    cases = (
+        ('str', r('abc'), 'abcdabdabccc'),
+        ('next', r('abc') @ r('d') @ r('a'), 'abcdabdabccc'),
+        ('func', r('1') @ r(str.isalpha) @ r('1'), 'a1a1'),
+        ('num', r('b', (1, 2)) @ r('cd'), 'bbcda'),
+        ('lazy', r('ab') @ r('c', (0, inf), Mode.lazy), 'abcccc'),
+        ('dot', r('a') @ dot.clone('*') @ r('a'), '123a123a123'),
+        ('and', (r('abc') @ dot.clone('*')) & (dot.clone('*') @ r('abc')), '1abchhabc1'),
+        ('or', (r('a') | r('b')) @ r('bc'), 'abcbbc'),
+        ('not', (~r(str.isdigit)).clone('+'), '123yyyyy123'),
+        ('xor', (r('ab') ^ r('ab')) @ r('c'), 'abc'),
+        ('capture', r('b', '+', ':b') @ r('cd', ':b'), 'bbcdcd'),
+        ('div', div, '0<div>1<div>2</div>3</div>4'),
+        # README 的样例未闭合, 重复后嵌套越来越深, 这里改用闭合的样例
+        ('block', block, '{{{{}{}}}}'),
+    )
+    for name, pattern, sample in cases:
+        yield 'readme', name, pattern, repeat(sample, size)
+
+
+def cpp(sizes):
+    import cpp_gen
+    for size in sizes:
+        yield 'cpp', 'cpp_gen/{}'.format(size), cpp_gen.matcher, repeat(cpp_gen.input_str, size)
+
+
+def stress(count: int = 64):
+    '''
+    回溯随输入指数增长的模式, 文本是 count 个较短的样例, 不随 --size 变化
+    数量条件的目标能匹配空串时(如 r(r('a', '*'), '*'))不会停止, 因此不在此列
+    '''
+    # 嵌套的数量条件, 失败前需要尝试所有的拆分方式
+    nested = r(r(r('a', '+'), '+'), '+') @ r('b')
+    alternation = r(r('a') | r('aa'), '+') @ r('b')
+    # 递归的嵌套深度受 Python 的递归深度限制
+    rw = RecursionWrapper()
+    paren = r('(') @ r(rw, '*') @ r(')')
+    rw.val = paren
+    depth = 24
+
+    yield 'stress', 'nested_plus', nested, ('a' * 6 + 'c') * count
+    yield 'stress', 'alternation', alternation, ('a' * 12 + 'c') * (count // 4)
+    yield 'stress', 'recursion', paren, ('(' * depth + ')' * depth) * count
+    yield 'stress', 'recursion_unclosed', paren, ('(' * depth + ')' * (depth - 1)) * count
@@ -1,6 +1,6 @@
 from collections import defaultdict
 
-from R import r, Mode
+from R import r, Mode, CharClass
 
 input_str = '''
 void PiXiuCtrl::init_prop() {
@@ -44,11 +44,12 @@ def success_get_0(capture: dict):
 
 sentinel = r('\0', success_get_0)
 
-spaces = r(str.isspace, '+')
-may_spaces = r(str.isspace, '*')
+space = CharClass(classes=('space',))
+spaces = r(space, '+')
+may_spaces = r(space, '*')
 
-char = r(lambda char: True)
-char_except_pair = r(lambda char: char not in '(){}')
+char = r(CharClass(classes=('any',)))
+char_except_pair = r(~CharClass('(){}'))
 may_chars_except_pair = char_except_pair.clone('*')
 
 l_parentheses = r('(', name=':(')
@@ -56,7 +57,7 @@ r_parentheses = r(')', name=':)')
 l_bracket = r('{', name=':{')
 r_bracket = r('}', name=':}')
 
-func_name = r(lambda char: str.isalpha(char) or str.isdigit(char) or char == '_', '+')
+func_name = r(CharClass('_', ('alpha', 'digit')), '+')
 type_name = r(func_name @ r(' *', (0, 1)), name=':type')
 var_name = r(func_name, name=':var')
 
@@ -88,8 +89,9 @@ matcher = (
     @ sentinel
 )
 
-result = matcher.match(input_str)
-print(result)
-for i in result:
-    print()
-    print(input_str[i.op:i.ed])
+if __name__ == '__main__':
+    result = matcher.match(input_str)
+    print(result)
+    for i in result:
+        print()
+        print(input_str[i.op:i.ed])
@@ -1,4 +1,15 @@
-from R import r, Mode, RecursionWrapper, BranchStop
+import copy
+import gc
+import io
+import os
+import pickle
+import tempfile
+import weakref
+from math import inf
+
+from R import r, Mode, RecursionWrapper, BranchStop, Context, RSet, CharClass, MatchSession, Profile, MatchLimit, PatternCache
+from R.Result import Result
+from R.analysis import first_set, required_prefix, min_len, max_len
 
 # 通配符
 dot = r(lambda char: True)
@@ -223,6 +234,562 @@ def t_branch_stop():
         assert bs.args == (0, 2)
 
 
+def t_compile():
+    '''
+    编译后的结果是否与逐节点匹配一致
+    '''
+    no_alpha = ~r(str.isalpha)
+    for m, s in (
+            ((r('abc') | r('cfg')) @ r('iop') @ r('iop'), 'pppcfgiopiop'),
+            (r('ab') @ r('c', '*', mode=Mode.lazy), 'abcccc'),
+            (r('a') @ dot.clone('*') @ r('a'), '123a123a123'),
+            (r(r('a') | r('ab'), '+') @ r('b'), 'abababb'),
+            (r(r('a', '*', mode=Mode.lazy) @ r('b', (0, 1)), '{1,3}') @ r('c'), 'aabacaabbc'),
+            (no_alpha @ r('1'), '123yy1'),
+            (r('b', '+', ':b') @ r('cd', ':b'), 'bbcdcd'),
+    ):
+        assert str(m.compile().match(s)) == str(m.match(s))
+
+    m = (r('ERROR') | r('WARN')) @ r(': ') @ r(str.isalpha, '+')
+    assert m.compile().program
+    # Fail 会被 ~ 使用, 不能编译
+    assert not (~m).compile().target.program
+
+    path = (r('a') @ (r('b') | r(lambda char: BranchStop()))).compile()
+    try:
+        path.match('ag')
+    except BranchStop as bs:
+        assert bs.args == (0, 2)
+
+
+def t_prefilter():
+    '''
+    起始位置的预筛选
+    '''
+    m = r('$gen ') @ r(str.isspace, '*') @ r(str.isalpha, '+')
+    assert required_prefix(m) == ('$gen ', False)
+    assert str(m.match('x' * 50 + '$gen  foo $gen')) == '[Result(50, 59, {})]'
+
+    m = (r('ab') | r('ac')) @ r('d')
+    assert required_prefix(m) == ('a', False)
+    assert first_set(m) == (frozenset('a'), False)
+
+    m = r('b', '*') @ (r('c') | r(str.isdigit))
+    assert first_set(m) == (None, False)
+    m = r('b', '*') @ r('c', (0, 1))
+    assert first_set(m) == (frozenset('bc'), True)
+
+    rw = RecursionWrapper()
+    block = (r('{') @ r(rw, '*') @ r('}')).clone(name=':block')
+    rw.val = block
+    assert first_set(block) == (frozenset('{'), False)
+    assert required_prefix(block) == ('{', False)
+
+
+def t_leaf():
+    '''
+    叶节点直接按下标匹配, Fail 停在第一个不匹配的字符
+    '''
+    m = ~r('abc')
+    assert str(m.match('abxab')) == '[Result(0, 3, {}), Result(4, 5, {})]'
+
+    m = r(str.isspace, '+') @ r('x')
+    assert str(m.match('  \t x  y')) == '[Result(0, 5, {})]'
+
+    m = r('ab', '{2,3}', ':ab') @ r('c')
+    assert str(m.match('abababc')) == "[Result(0, 7, {':ab': [(0, 2), (2, 4), (4, 6)]})]"
+
+    # 贪婪模式回溯时才给出更少的次数
+    m = r('x') @ dot.clone('*') @ r('y')
+    assert str(m.match('x' + 'a' * 100000 + 'yz')) == '[Result(0, 100002, {})]'
+    m = r('a', '*', ':a') @ r('ab')
+    assert str(m.match('aaab')) == "[Result(0, 4, {':a': [(0, 1), (1, 2)]})]"
+
+
+def t_context():
+    '''
+    每次 match 使用独立的缓存上下文
+    '''
+    # 函数中再次调用 match
+    word = r(str.isalpha, '+')
+    m = r(lambda char: bool(word.match(char)), '+') @ r('1')
+    assert str(m.match('ab1cd2')) == '[Result(0, 3, {})]'
+
+    # 多线程同时匹配
+    from concurrent.futures import ThreadPoolExecutor
+    m = (r('abc') | r('ab')) @ r('c', '*') @ r('d')
+    with ThreadPoolExecutor(4) as pool:
+        outputs = list(pool.map(m.match, ['abcd' * i + 'abccd' for i in range(32)]))
+    for i, output in enumerate(outputs):
+        assert len(output) == i + 1 and output[-1].ed == 4 * i + 5
+
+    # 在同一个 resource 上复用
+    ctx = Context(slide=False)
+    m = r('a') @ r(r('b') | r('bc'), '+') @ r('d')
+    assert str(m.match('abcbd', ctx)) == str(m.match('abcbd', ctx)) == '[Result(0, 5, {})]'
+    assert ctx.memo
+
+    # 缓存随游标滑动释放, 并受条目上限约束
+    ctx = Context(max_entries=64)
+    m = r(r('ab') | r('a'), '+') @ r('c')
+    assert len(m.match('ab' * 500 + 'c' + 'abac' * 100, ctx)) == 101
+    assert len(ctx.memo) <= 64
+    ctx = Context()
+    m.match('abac' * 100, ctx)
+    assert all(k[2] >= 396 for k in ctx.memo)
+
+
+def t_result():
+    '''
+    捕获组以持久化链表存储, 对外仍是 dict
+    '''
+    from R.Result import Result
+    a = Result(0, 2, {':a': [(0, 1)]})
+    b = a.clone().capture_add(':a', 1, 2)
+    c = b.clone().capture_add(':b', 0, 2)
+    assert a.capture == {':a': [(0, 1)]}
+    assert c.capture == {':a': [(0, 1), (1, 2)], ':b': [(0, 2)]}
+    assert c.spans.prev is b.spans and b.spans.prev is a.spans
+    assert not hasattr(c, '__dict__')
+
+    # 指纹只取决于 dict 视图, 与捕获的交错顺序无关
+    d = Result(0, 2).capture_add(':b', 0, 2).capture_add(':a', 0, 1).capture_add(':a', 1, 2)
+    assert d.hash == c.hash and hash(d.hash) == hash(c.hash) and d.hash is not c.hash
+    assert d.hash != b.hash and d.count(':a') == 2 and a.count(':b') == 0
+
+    m = r(r('a', name=':a') @ r('b', '*', ':b'), '+')
+    result, = m.match('aababb')
+    assert result.capture == {':a': [(0, 1), (1, 2), (3, 4)], ':b': [(2, 3), (4, 5), (5, 6)]}
+
+
+def t_window():
+    startswith_abc = r('abc') @ r(dot, '*')
+    endswith_abc = r(dot, '*') @ r('abc')
+    m = (startswith_abc & endswith_abc) @ r('X')
+    line = 'abc' + 'z' * 300 + 'abcX'
+    result, = m.match(line)
+    assert (result.op, result.ed) == (0, len(line))
+
+    # ^ 在 [op, ed) 的窗口内原地比较, end 之外的字符不可见
+    m = (r('ab') ^ r('a') @ r('c')) @ r('d')
+    assert [(i.op, i.ed) for i in m.match('abdacd')] == [(0, 3), (3, 6)]
+    assert [(i.op, i.ed) for i in m.imatch('xxabd', Result(2, 2))] == [(2, 5)]
+    assert list(m.imatch('xxabd', Result(2, 2), end=4)) == []
+
+
+def t_stream():
+    text = 'xé abc' * 50 + 'abc'
+    for m in (r('abc', name=':a'), r('a') @ r(lambda char: char != 'x', '*') @ r('c')):
+        expected = str(m.match(text))
+        for chunk_size in (1, 3, 64):
+            assert str(list(m.match_stream(io.StringIO(text), chunk_size))) == expected
+            # 多字节字符可能被切开
+            assert str(list(m.match_stream(io.BytesIO(text.encode()), chunk_size))) == expected
+
+    # 结果确定后立即交出, 不必读完输入
+    stream = io.StringIO('abc' + 'z' * 1000)
+    assert (next(r('abc').match_stream(stream, 8)).ed, stream.tell()) == (3, 8)
+
+    # 尝试读到缓冲区末尾时立即中止, 而不是在不完整的输入上回溯完所有可能
+    m = r(r(r('a', '+'), '+') @ r('b'))
+    text = ('a' * 24 + 'b ') * 3
+    assert str(list(m.match_stream(io.StringIO(text), 8, max_steps=1000))) == str(m.match(text))
+
+
+def t_iter():
+    calls = []
+
+    def isdigit(char):
+        calls.append(char)
+        return char.isdigit()
+
+    m = r(isdigit, '+')
+    it = m.finditer('12a34b56')
+    assert (next(it).op, next(it).op) == (0, 3)
+    # 停止迭代后不再匹配剩余部分
+    assert calls[-1] == 'b' and '5' not in calls
+    it.close()
+
+    assert m.search('ab') is None and m.search('a12').op == 1
+    assert [(i.op, i.ed) for i in m.finditer('1a2')] == [(i.op, i.ed) for i in m.match('1a2')]
+
+    # fullmatch 会回溯到恰好结束于末尾的结果
+    m = r('a', '*') @ r('ab', '{0,1}')
+    assert (m.fullmatch('aab').op, m.fullmatch('aab').ed) == (0, 3)
+    assert m.fullmatch('aabc') is None and r('b').fullmatch('ab') is None
+    assert r('a', '*').fullmatch('').ed == 0
+
+
+def t_rset():
+    digits = r(str.isdigit, '+')
+    patterns = [r('ab') @ digits, r('abc'), digits, (r('x') | r('ab')) @ digits.clone(name=':n'), r('z')]
+    rs = RSet(patterns)
+    text = 'ab12 abc x3 ab4'
+    expected = sorted((result.op, i, str(result)) for i, pattern in enumerate(patterns) for result in pattern.match(text))
+    assert [(result.op, i, str(result)) for i, result in rs.match(text)] == expected
+    assert [i for i, _ in rs.finditer('abc1')] == [1, 2]
+    assert RSet([]).match('abc') == [] and len(rs) == 5
+
+    # 首字符集合未知的 R 按开头的叶节点分组, 只有能匹配空串的 R 需要在每个位置尝试
+    digit = CharClass('', ('digit',))
+    patterns = [r(digit, '+') @ r('k{}'.format(i)) for i in range(20)] + [r(str.isupper) @ r('q'), r('a', '*')]
+    text = ('word ' * 300 + '12k3 Qq k7 ') * 2
+    for subset in (patterns, patterns[:20]):
+        expected = sorted((result.op, i, str(result)) for i, pattern in enumerate(subset) for result in pattern.match(text))
+        assert [(result.op, i, str(result)) for i, result in RSet(subset).match(text)] == expected
+    assert RSet(patterns).always == [21] and len(RSet(patterns).by_leaf) == 2
+    # 叶节点都是 CharClass 时仍然可以跳过不可能开始匹配的位置
+    assert RSet(patterns[:20]).seekable and not RSet(patterns[:21]).seekable
+
+
+def t_parallel():
+    assert max_len(r('ab', '{1,3}') @ (r('c') | r('dd'))) == 8
+    rw = RecursionWrapper()
+    block = r('{') @ r(rw, '*') @ r('}')
+    rw.val = block
+    assert max_len(block) == inf and max_len(~r('abc')) == 3
+
+    m = r('ab', name=':a') @ r(str.isdigit, '{0,3}') | r('ba')
+    text = 'ab1ba22bab333ab' * 20
+    for chunk_size in (1, 2, 5, 64):
+        assert str(m.match_parallel(text, workers=2, chunk_size=chunk_size)) == str(m.match(text))
+    # 无界时退回 match
+    assert str(block.match_parallel('{{}}' * 10, workers=2, chunk_size=4)) == str(block.match('{{}}' * 10))
+
+
+def t_portable():
+    rw = RecursionWrapper()
+    block = (r('{') @ r(rw, '*') @ r('}')).clone(name=':block')
+    rw.val = block
+    word = r(CharClass('_', ('alnum',)), '+')
+    shared = r('x')
+    for m in (block, word.compile() @ r(' '), r(shared) | r(shared) @ word):
+        copied = pickle.loads(pickle.dumps(m))
+        assert str(copied) == str(m)
+        for text in ('{{{{{}{}}}', 'a_1 b ', 'xx1'):
+            assert str(copied.match(text)) == str(m.match(text))
+    copied = pickle.loads(pickle.dumps(block))
+    assert len(copied.to_portable()['wrappers']) == 1
+    assert CharClass('a') == CharClass('a') and (~CharClass('a'))('b') and not CharClass('', ('digit',))('x')
+
+    try:
+        pickle.dumps(r(lambda char: True))
+        assert False
+    except TypeError:
+        pass
+    # 深复制不需要序列化
+    m = dot.clone('*') @ r('a')
+    copied = copy.deepcopy(m)
+    assert copied is not m and copied.target is not m.target and str(copied.match('xxa')) == str(m.match('xxa'))
+    copied = copy.deepcopy(block)
+    # RecursionWrapper 和环一起复制
+    rw_copy = copied.target.target.next_r._target
+    assert isinstance(rw_copy, RecursionWrapper) and rw_copy is not rw and rw_copy.val is copied
+    assert str(copied.match('{{}}')) == str(block.match('{{}}'))
+
+    documents = ['ab cd', '', '!!', 'x'] * 10
+    assert str(list(word.match_many(documents, workers=2, batch=3))) == str([word.match(i) for i in documents])
+
+
+def t_bounds():
+    m = r('ab', '{1,3}') @ (r('c') | r('dd'))
+    assert m.bounds == (3, 8) and min_len(m) == 3 and max_len(m) == 8
+    assert (r('ab') & r(str.isalpha, '*')).bounds == (2, 2)
+    assert (~r('abc')).bounds == (0, 3) and r('a', ':a').bounds == (0, inf)
+    rw = RecursionWrapper()
+    block = r('{') @ r(rw, '*') @ r('}')
+    rw.val = block
+    assert block.bounds == (2, inf)
+    rw = RecursionWrapper()
+    endless = r('a') @ r(rw)
+    rw.val = endless
+    assert endless.bounds[1] == inf and endless.match('aaa') == []
+
+    calls = []
+
+    def isdigit(char):
+        calls.append(char)
+        return char.isdigit()
+
+    # 剩余的字符不够 min_len 时不再尝试
+    m = r(r(isdigit) @ r('-'), 3)
+    assert [(i.op, i.ed) for i in m.match('1-2-3-4-')] == [(0, 6)]
+    assert calls == list("123")
+    assert m.fullmatch('1-2-') is None and m.fullmatch('1-2-3-').ed == 6
+
+
+def t_charclass():
+    hex_digit = CharClass(ranges=[('0', '9'), ('a', 'f')])
+    assert hex_digit('7') and hex_digit('c') and not hex_digit('g') and (~hex_digit)('g')
+    word = hex_digit | CharClass('_', ('alpha',))
+    assert word('_') and word('z') and not word('-')
+    assert (~hex_digit | CharClass('0'))('0') and not (~hex_digit | CharClass('0'))('1')
+    assert hex_digit.finite() == frozenset('0123456789abcdef') and word.finite() is None
+    assert first_set(r(hex_digit, '+'))[0] == hex_digit.finite()
+    assert pickle.loads(pickle.dumps(word)) == word
+
+    # 短的 resource 逐个查表, 长的先求出整段的成员标记
+    m = r(hex_digit, (2, inf)) @ r(~CharClass('', ('space',)))
+    for text in ('ff!0x1f beef\n', ('ab ' * 500 + 'abc-') * 2):
+        lam = r(lambda char: char in '0123456789abcdef', (2, inf)) @ r(lambda char: not char.isspace())
+        assert str(m.match(text)) == str(lam.match(text)) == str(m.compile().match(text))
+
+    # 成员标记存在各自的 Context 中, 交替匹配两个 resource 互不影响, 匹配结束后不再持有 resource
+    class Text(str):
+        # str 本身不支持弱引用
+        pass
+
+    digits = r(CharClass('', ('digit',)), '+')
+    text_a, text_b = Text('12 ' * 500), '345 x ' * 400
+    iter_a, iter_b = digits.finditer(text_a), digits.finditer(text_b)
+    got_a, got_b = [], []
+    # 较短的 iter_b 在前, zip 结束时不会多取 iter_a 的结果
+    for echo_b, echo_a in zip(iter_b, iter_a):
+        got_a.append(echo_a.ed)
+        got_b.append(echo_b.ed)
+    got_a.extend(echo.ed for echo in iter_a)
+    assert got_a == [i * 3 + 2 for i in range(500)] and got_b == [i * 6 + 3 for i in range(400)]
+    ref = weakref.ref(text_a)
+    del text_a, iter_a
+    gc.collect()
+    assert ref() is None
+
+    # 懒惰模式同样使用 Context 中的成员标记
+    lazy = r(CharClass('', ('digit',)), '+', mode=Mode.lazy) @ r('x')
+    ctx = Context()
+    text = '12x ' * 300
+    assert str(lazy.match(text, ctx)) == str((r(str.isdigit, '+', mode=Mode.lazy) @ r('x')).match(text))
+    assert list(ctx.masks) == [CharClass('', ('digit',))]
+
+
+def t_optimize():
+    assert str((r('abc') @ r('d') @ r('a')).optimize()) == 'abcda'
+    assert str(r(r('a'), 5).optimize()) == '(a{5})'
+    assert str(((r('ab') | r('ac')) @ r('x')).optimize()) == 'a(b|c)x'
+    m = r('a', name=':a') @ r('b') @ r('c', mode=Mode.lazy)
+    assert m.optimize().match('abc')[0].capture == {':a': [(0, 1)]}
+    assert m.optimize() is m.optimize() and m.optimize().optimize() is m.optimize()
+
+    # Fail 可见时不合并, ~ 和 ^ 的结果不变
+    for m in (~(r('ab') @ r('c')), (r('ab') @ r('c')) ^ r('abd'), ~(r('ab') | r('ac')), ~r(r('a'), 3)):
+        plain = m.clone()
+        plain.optimized = plain
+        for text in ('abd', 'abc', 'aad', 'aaa'):
+            assert str(m.match(text)) == str(plain.match(text))
+
+
+def t_dispatch():
+    m = r('if') | r('int') | r('for') | r(~CharClass(' !'), (1, inf)) | r('!', (0, 1))
+    table, default, branches = m.optimize().dispatch
+    assert sorted(table) == ['f', 'i']
+    assert [str(i) for i in table['f']] == ['for', '(%[^ !]%{1,inf})', '(!{0,1})']
+    assert [str(i) for i in table['i']] == ['i(f|nt)', '(%[^ !]%{1,inf})', '(!{0,1})']
+    assert [str(i) for i in default] == ['(%[^ !]%{1,inf})', '(!{0,1})']
+    expect = '[Result(0, 2, {}), Result(2, 2, {}), Result(3, 4, {}), Result(4, 4, {}), Result(5, 8, {}), Result(8, 9, {})]'
+    assert str(m.match('if x int!')) == expect
+
+    # 优先级与捕获组不变
+    m = r('a', name=':a') @ r('b') | r('ab', name=':ab') | r(str.isalpha, 2)
+    assert m.match('abxy')[0].capture == {':a': [(0, 1)]}
+    assert str(m.match('xy')) == '[Result(0, 2, {})]'
+
+    # Fail 可见时不建立分派表
+    m = ~(r('a') | r('b'))
+    assert all(node.dispatch is None for node in (m.optimize(), m.optimize().target))
+    assert str(m.match('cab')) == '[Result(0, 1, {}), Result(1, 2, {}), Result(2, 3, {})]'
+
+    # 可以匹配 0 次的 CharClass 不能决定分支的首字符
+    m = r('bc') | r(CharClass('a'), 0) @ r(~CharClass('c'), '+') @ r('c')
+    assert str(m.match('bbc')) == '[Result(0, 3, {})]'
+
+
+def t_session():
+    m = r('(') @ r(str.isalpha, '*') @ r(')') | r(str.isdigit, '+')
+    text = '(ab) 12 (cd) 3 (ef'
+    session = MatchSession(m, text)
+    assert str(session.results) == str(m.match(text))
+    for start, end, replacement in ((5, 7, '456'), (0, 1, ''), (3, 3, '('), (len(text) - 1, len(text) - 1, ')'),
+                                    (9, 9, ')'), (0, 0, '7')):
+        session.edit(start, end, replacement)
+        assert str(session.results) == str(m.match(session.text))
+    assert session.text == '7ab)( 456 )(cd) 3 ()ef'
+
+    # 只重新匹配修改附近的位置
+    tried = []
+
+    def digit(char: str):
+        tried.append(char)
+        return char.isdigit()
+
+    session = MatchSession(r(digit, '+'), '1 2 3 4 5 6 7 8 9')
+    tried.clear()
+    session.edit(8, 9, '55')
+    assert len(tried) <= 4
+    assert [(i.op, i.ed) for i in session.results][3:6] == [(6, 7), (8, 10), (11, 12)]
+
+
+def t_profile():
+    digits = r(str.isdigit, '+', name=':d')
+    m = r('[') @ digits @ r(']')
+    profile = m.profile('[12] [3')
+    stats = profile.dump()
+    # '12' 和之后的 ']', 以及 '3'
+    assert [i['chars'] for i in stats if i['name'] == ':d'] == [3 + 1]
+    assert [i['calls'] for i in stats if i['node'] == repr(m.optimize())] == [2]
+    assert all(i['calls'] == i['hits'] + i['misses'] and i['self_time'] <= i['time'] for i in stats)
+    assert profile.report().splitlines()[0].split()[-1] == 'node'
+
+    # 数量条件的 DFS 回退
+    m = r(r('a') | r('ab'), '+') @ r('c')
+    profile = Profile()
+    assert str(m.match('abc', Context(profile=profile))) == '[Result(0, 3, {})]'
+    assert profile.of(m.optimize()).backtracks > 0
+
+
+def t_limit():
+    m = r(r(r('a', '+'), '+'), '+') @ r('b')
+    text = 'ab ' + 'a' * 30 + 'c'
+    for kwargs in ({'max_steps': 10000}, {'timeout': 0.05}):
+        try:
+            m.match(text, **kwargs)
+            assert False
+        except MatchLimit as ml:
+            # (游标, 读取到的最远位置), 已确定的结果
+            assert ml.args == (3, len(text))
+            assert str(ml.results) == '[Result(0, 2, {})]'
+
+    try:
+        m.fullmatch('a' * 30 + 'c', max_steps=1000)
+        assert False
+    except MatchLimit as ml:
+        assert ml.args[0] == 0 and ml.results == []
+
+    # 流式匹配和 RSet 同样受限, 位置为整个输入中的绝对坐标
+    try:
+        list(m.match_stream(io.StringIO(text), 4, max_steps=10000))
+        assert False
+    except MatchLimit as ml:
+        assert ml.args == (3, len(text)) and str(ml.results) == '[Result(0, 2, {})]'
+    try:
+        RSet([m]).match(text, max_steps=10000)
+        assert False
+    except MatchLimit as ml:
+        assert ml.args == (3, len(text)) and str(ml.results) == '[(0, Result(0, 2, {}))]'
+
+    # 限制可以设在 Context 上, 每次匹配重新计步
+    ctx = Context(max_steps=100)
+    for _ in range(2):
+        assert str(m.match('ab aab', ctx)) == '[Result(0, 2, {}), Result(3, 6, {})]'
+        assert ctx.steps <= 100
+
+
+def t_codegen():
+    '''
+    生成的匹配函数是否与逐节点匹配一致
+    '''
+    div_head = r('<div', name=':head')
+    div_tail = r('</div>', name=':tail')
+    sentinel = r('\00', lambda capture: 0 if len(capture.get(':head', ())) == len(capture.get(':tail', ())) else 1)
+    rw = RecursionWrapper()
+    block = (r('{') @ r(rw, '*') @ r('}')).clone(name=':block')
+    rw.val = block
+    for m, s in (
+            ((r('abc') | r('cfg')) @ r('iop') @ r('iop'), 'pppcfgiopiop'),
+            (r('ab') @ r('c', '*', mode=Mode.lazy), 'abcccc'),
+            (r('a') @ dot.clone('*') @ r('a'), '123a123a123'),
+            (r(r('a') | r('ab'), '+') @ r('b'), 'abababb'),
+            (r(r('a', '*', mode=Mode.lazy) @ r('b', (0, 1)), '{1,3}') @ r('c'), 'aabacaabbc'),
+            ((r('abc') @ dot.clone('*')) & (dot.clone('*') @ r('abc')), '1abchhabc1'),
+            ((~r(str.isdigit)).clone('+'), '123yyyyy123'),
+            ((r('ab') ^ r('ab')) @ r('c'), 'abc'),
+            (r('b', '+', ':b') @ r('cd', ':b'), 'bbcdcd'),
+            (div_head @ r(div_head | div_tail | ~(div_head | div_tail), '+') @ div_tail @ sentinel,
+             '0<div>1<div>2</div>3</div>4'),
+            (block, '{{{{{}{}}}'),
+    ):
+        assert str(m.codegen().match(s)) == str(m.match(s))
+
+    m = r('ab', name=':x') @ r(CharClass('', ('digit',)), '+')
+    generated = m.codegen()
+    # 缓存在 R 上, 字符串直接写入源码
+    assert m.codegen() is generated
+    assert "'ab'" in generated.source and 'bridge' not in generated.source
+    assert str(generated.match('ab12 ab x')) == "[Result(0, 4, {':x': [(0, 2)]})]"
+    assert [echo.ed for echo in generated.imatch('ab123')] == [5, 4, 3]
+
+    path = r('a') @ (r('b') | r(lambda char: BranchStop()))
+    try:
+        path.codegen().match('ag')
+        assert False
+    except BranchStop as bs:
+        assert bs.args == (0, 2)
+
+
+def t_diskcache():
+    def patterns():
+        # 每次重新构建, 相当于新的进程
+        rw = RecursionWrapper()
+        block = (r('{') @ r(rw, '*') @ r('}')).clone(name=':block')
+        rw.val = block
+        word = r(CharClass('_', ('alnum',)), '+')
+        return block, (r('ERROR') | r('WARN')) @ r(': ') @ word, r(str.isdigit, '+') @ dot
+
+    text = '{{{{{}{}}}ERROR: disk 12a'
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'R.cache')
+        cache = PatternCache(path)
+        cache.warm(patterns()[:2])
+        assert os.path.exists(path) and cache.misses == 4
+
+        cache = PatternCache(path)
+        block, log, lam = patterns()
+        cache.attach(block, log, lam)
+        assert cache.entries is None
+        for m, base in zip((block, log, lam), patterns()):
+            assert str(m.match(text)) == str(base.match(text))
+            assert str(m.compile().match(text)) == str(base.match(text))
+        # lambda 无法序列化, 照常改写
+        assert cache.hits == 4 and cache.misses == 2 and not cache.dirty
+
+        # 结构不同时指纹不同, clone 沿用 block 的缓存
+        block.clone(name=':other').optimize()
+        assert cache.misses == 3 and cache.dirty
+
+        # 损坏的文件或条目视为未命中
+        with open(path, 'rb') as f:
+            data = f.read()
+        for i in range(0, len(data), 7):
+            with open(path, 'wb') as f:
+                f.write(data[:i] + bytes([data[i] ^ 0x5a]) + data[i + 1:])
+            cache = PatternCache(path)
+            log = patterns()[1]
+            cache.attach(log)
+            assert str(log.match(text)) == str(patterns()[1].match(text))
+
+        # 指纹不延长 pattern 的生命周期
+        ref = weakref.ref(log)
+        del log
+        gc.collect()
+        assert ref() is None and len(cache.prints) == 0
+
+
+def t_intern():
+    def word():
+        return r(str.isalpha, '+') @ r(' ', '+')
+
+    # 分别构建的相同片段合并为同一个实例
+    assert word().intern() is word().intern()
+    m = r(word(), '+') @ r('.') | r(word(), '+') @ r('!')
+    o = m.optimize()
+    assert o.target.target is o.or_r.target
+    assert str(m.intern().match('ab cd !')) == str(m.match('ab cd !')) == "[Result(0, 7, {})]"
+
+    # Fail 可见性不同的节点不合并, 只有 Fail 不可见的一方建立分派表
+    a, b = (r('a') | r('b')).optimize(), (~(r('a') | r('b'))).optimize().target
+    assert a is not b and a.dispatch is not None and b.dispatch is None
+    assert str((~(r('a') | r('b'))).match('cab')) == '[Result(0, 1, {}), Result(1, 2, {}), Result(2, 3, {})]'
+
+
 for func in (
         t_str,
         t_simple,
@@ -236,6 +803,27 @@ for func in (
         t_div,
         t_recursive,
         t_branch_stop,
+        t_compile,
+        t_prefilter,
+        t_leaf,
+        t_context,
+        t_result,
+        t_window,
+        t_stream,
+        t_iter,
+        t_rset,
+        t_parallel,
+        t_portable,
+        t_bounds,
+        t_charclass,
+        t_optimize,
+        t_dispatch,
+        t_session,
+        t_profile,
+        t_limit,
+        t_codegen,
+        t_diskcache,
+        t_intern,
 ):
     func()
 print('all pass')